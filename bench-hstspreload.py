@@ -0,0 +1,856 @@
+"""Benchmarks hstspreload offline against the packaged hstspreload.bin"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+import urllib.parse
+
+import hstspreload
+from hstspreload import (
+    _GTLD_INCLUDE_SUBDOMAINS,
+    _INCLUDE_SUBDOMAINS,
+    _IS_LEAF,
+    _decode_bucket,
+    _get_data,
+    _in_bloom_filter,
+    _iter_leaves,
+    _iter_rules,
+    _match_bucket,
+    _match_compact_entries,
+    _match_entries,
+    _parse_data,
+    _parse_sections,
+)
+
+BATCH_SIZES = (1, 10, 100, 1000, 10000, 100000)
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BENCHMARKS = (
+    "import",
+    "single",
+    "rules",
+    "batches",
+    "engines",
+    "bloom_filter",
+    "buckets",
+    "formats",
+    "urls",
+    "event_loop",
+    "workers",
+    "build",
+)
+
+
+def load_corpus(size):
+    """Builds a deterministic corpus of 'size' synthetic hosts for each kind of
+    lookup: gTLD fast path hits, deep leaf hits, subdomain hits and misses that
+    stop at different depths.
+    """
+    rand = random.Random(0)
+    leaves = [
+        (name, include)
+        for name, include in _iter_leaves()
+        if name.rsplit(b".", 1)[-1] not in _GTLD_INCLUDE_SUBDOMAINS
+    ]
+    deep = [name for name, _ in leaves if name.count(b".") >= 2]
+    include = [name for name, include in leaves if include]
+    exact = [name for name, include in leaves if not include]
+    gtlds = sorted(_GTLD_INCLUDE_SUBDOMAINS)
+
+    def numbered(template):
+        return [template % rand.randrange(10**9) for _ in range(size)]
+
+    return {
+        "gtld": [b"www.%d." % i + rand.choice(gtlds) for i in range(size)],
+        "leaf": [rand.choice(deep) for _ in range(size)],
+        "subdomain": [b"www." + rand.choice(include) for _ in range(size)],
+        "miss-tld": numbered(b"not-preloaded-%d.com"),
+        "miss-deep": numbered(b"a.b.c.not-preloaded-%d.co.uk"),
+        "miss-leaf": [b"not-preloaded." + rand.choice(exact) for _ in range(size)],
+    }
+
+
+def mixed_hosts(corpus, size):
+    """Draws every kind of host from the corpus in a deterministic order"""
+    hosts = [host for kind in corpus.values() for host in kind]
+    rand = random.Random(0)
+    return [rand.choice(hosts) for _ in range(size)]
+
+
+def clear_caches():
+    """Forgets cached results and decoded buckets, but keeps the data file open"""
+    hstspreload.cache_clear()
+    data = hstspreload._data
+    if data is not None:
+        with hstspreload._buckets_lock:
+            data.decoded.clear()
+
+
+def percentile(values, fraction):
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench_import():
+    # Import with cached bytecode like an installed package would.
+    pycache = tempfile.TemporaryDirectory()
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=pycache.name)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    self_us = []
+    cumulative_us = []
+    first_lookup_us = []
+    for _ in range(5):
+        output = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import hstspreload"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=ROOT,
+            env=env,
+        ).stderr
+        for line in output.splitlines():
+            fields = [field.strip() for field in line.split("|")]
+            if fields[-1] == "hstspreload":
+                self_us.append(int(fields[0].split(":")[1]))
+                cumulative_us.append(int(fields[1]))
+
+        # Includes mapping and parsing the data file.
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import time, hstspreload\n"
+                "start = time.perf_counter()\n"
+                "hstspreload.in_hsts_preload('paypal.com')\n"
+                "print((time.perf_counter() - start) * 1e6)",
+            ],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=ROOT,
+            env=env,
+        ).stdout
+        first_lookup_us.append(float(output))
+    pycache.cleanup()
+
+    results = {
+        "self_us": min(self_us),
+        "cumulative_us": min(cumulative_us),
+        "first_lookup_us": min(first_lookup_us),
+    }
+    print("%16s %16s %18s" % ("import (us)", "with deps (us)", "first lookup (us)"))
+    print(
+        "%16d %16d %18.1f"
+        % (results["self_us"], results["cumulative_us"], results["first_lookup_us"])
+    )
+    return results
+
+
+def bench_single(corpus):
+    print(
+        "%10s %12s %12s %12s %12s"
+        % ("hosts", "cold (us)", "cold p99", "uncached", "warm (us)")
+    )
+    results = {}
+    try:
+        for kind, hosts in corpus.items():
+            # Cold: nothing cached, every bucket is scanned in the data file.
+            timings = []
+            hstspreload.set_cache_size(0)
+            for host in hosts:
+                clear_caches()
+                start = time.perf_counter()
+                hstspreload.in_hsts_preload(host)
+                timings.append(time.perf_counter() - start)
+
+            # Uncached: no cached results but hot buckets are decoded.
+            start = time.perf_counter()
+            for host in hosts:
+                hstspreload.in_hsts_preload(host)
+            uncached = (time.perf_counter() - start) / len(hosts)
+
+            # Warm: every result is cached.
+            hstspreload.set_cache_size(None)
+            for host in hosts:
+                hstspreload.in_hsts_preload(host)
+            start = time.perf_counter()
+            for host in hosts:
+                hstspreload.in_hsts_preload(host)
+            warm = (time.perf_counter() - start) / len(hosts)
+
+            results[kind] = {
+                "cold_us": sum(timings) / len(timings) * 1e6,
+                "cold_p50_us": percentile(timings, 0.5) * 1e6,
+                "cold_p99_us": percentile(timings, 0.99) * 1e6,
+                "uncached_us": uncached * 1e6,
+                "warm_us": warm * 1e6,
+            }
+            print(
+                "%10s %12.2f %12.2f %12.2f %12.2f"
+                % (
+                    kind,
+                    results[kind]["cold_us"],
+                    results[kind]["cold_p99_us"],
+                    results[kind]["uncached_us"],
+                    results[kind]["warm_us"],
+                )
+            )
+    finally:
+        hstspreload.set_cache_size(1024)
+        clear_caches()
+    return results
+
+
+def bench_rules(size=100000, rules=200):
+    """Looks up distinct subdomains of a few include_subdomains entries, which
+    the cache holds by entry rather than by host
+    """
+    rand = random.Random(0)
+    names = [name for name, include in _iter_rules() if include and b"." in name]
+    names = rand.sample(names, rules)
+    hosts = [b"host-%d.%s" % (i, rand.choice(names)) for i in range(size)]
+
+    print("%10s %12s %12s %12s" % ("cache", "hits (%)", "size", "lookup (us)"))
+    results = {}
+    try:
+        for maxsize in (0, 1024):
+            hstspreload.set_cache_size(maxsize)
+            clear_caches()
+            start = time.perf_counter()
+            for host in hosts:
+                hstspreload.lookup(host)
+            elapsed = time.perf_counter() - start
+            info = hstspreload.cache_info()
+
+            results[str(maxsize)] = {
+                "hits_percent": info.hits * 100 / size,
+                "currsize": info.currsize,
+                "lookup_us": elapsed / size * 1e6,
+            }
+            print(
+                "%10d %12.2f %12d %12.2f"
+                % (maxsize, info.hits * 100 / size, info.currsize, elapsed / size * 1e6)
+            )
+    finally:
+        hstspreload.set_cache_size(1024)
+        clear_caches()
+    return results
+
+
+def bench_batches(hosts):
+    print(
+        "%10s %16s %16s %16s"
+        % ("batch", "loop (us/host)", "many (us/host)", "many (hosts/s)")
+    )
+    results = {}
+    for batch_size in BATCH_SIZES:
+        batch = hosts[:batch_size]
+        repeat = max(1, 10000 // batch_size)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            clear_caches()
+            for host in batch:
+                hstspreload.in_hsts_preload(host)
+        loop = (time.perf_counter() - start) / (repeat * batch_size)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            clear_caches()
+            hstspreload.in_hsts_preload_many(batch)
+        many = (time.perf_counter() - start) / (repeat * batch_size)
+
+        results[str(batch_size)] = {
+            "loop_us": loop * 1e6,
+            "many_us": many * 1e6,
+            "many_hosts_per_s": 1 / many,
+        }
+        print(
+            "%10d %16.2f %16.2f %16d" % (batch_size, loop * 1e6, many * 1e6, 1 / many)
+        )
+    return results
+
+
+def bench_engines(hosts):
+    print(
+        "%10s %12s %12s %12s %16s"
+        % ("engine", "load (ms)", "heap (KB)", "peak (KB)", "lookup (us)")
+    )
+    results = {}
+    for engine in ("default", "index"):
+        hstspreload.close()
+        hstspreload.unload_index()
+        clear_caches()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        if engine == "index":
+            hstspreload.load_index()
+        else:
+            hstspreload.reopen()
+        load = time.perf_counter() - start
+        heap = tracemalloc.get_traced_memory()[0]
+        for host in hosts[:10000]:
+            hstspreload._lookup(host)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        clear_caches()
+        start = time.perf_counter()
+        for host in hosts[:10000]:
+            hstspreload._lookup(host)
+        lookup = (time.perf_counter() - start) / len(hosts[:10000])
+
+        results[engine] = {
+            "load_ms": load * 1e3,
+            "heap_kb": heap / 1024,
+            "peak_kb": peak / 1024,
+            "lookup_us": lookup * 1e6,
+        }
+        print(
+            "%10s %12.1f %12d %12d %16.2f"
+            % (engine, load * 1e3, heap / 1024, peak / 1024, lookup * 1e6)
+        )
+    hstspreload.unload_index()
+    return results
+
+
+def bench_bloom_filter():
+    print(
+        "%10s %12s %16s %16s" % ("hosts", "filter FP", "filter (us)", "no filter (us)")
+    )
+    data = _get_data()
+    rand = random.Random(0)
+    misses = [
+        b"www.not-preloaded-%d.%s" % (rand.randrange(10**9), tld)
+        for tld in (b"com", b"org", b"co.uk")
+        for _ in range(10000)
+    ]
+    false_positives = sum(_in_bloom_filter(data.bloom, host) for host in misses)
+
+    timings = []
+    for bloom in (data.bloom, None):
+        hstspreload._data = data._replace(bloom=bloom)
+        clear_caches()
+        start = time.perf_counter()
+        for host in misses:
+            hstspreload.in_hsts_preload(host)
+        timings.append((time.perf_counter() - start) / len(misses))
+    hstspreload._data = data
+
+    results = {
+        "false_positive_rate": false_positives / len(misses),
+        "filter_us": timings[0] * 1e6,
+        "no_filter_us": timings[1] * 1e6,
+    }
+    print(
+        "%10s %11.2f%% %16.2f %16.2f"
+        % (
+            "misses",
+            results["false_positive_rate"] * 100,
+            results["filter_us"],
+            results["no_filter_us"],
+        )
+    )
+    return results
+
+
+def _match_entries_copying(data, host, label):
+    # The decoder before entries were compared in place, kept as a baseline.
+    while data:
+        flags = data[0]
+        size = data[1]
+        ent_label = bytes(data[2 : 2 + size])
+        if flags & _IS_LEAF:
+            if ent_label == host:
+                return True
+            if flags & _INCLUDE_SUBDOMAINS and host.endswith(b"." + ent_label):
+                return True
+        elif label == ent_label:
+            return None
+        data = data[2 + size :]
+    return False
+
+
+def bench_buckets():
+    print(
+        "%10s %12s %12s %12s %12s"
+        % ("size", "copying (us)", "in place", "decode", "decoded")
+    )
+    data = _get_data()
+    suffixes = data.suffixes
+    offsets = list(hstspreload._iter_offsets(data))
+    spans = sorted(zip(offsets, offsets[1:]), key=lambda x: x[1] - x[0])
+    largest = [data.buckets[start:end] for start, end in spans[-5:]]
+    # A miss that has to scan through every entry of the bucket.
+    host, suffix, label = b"www.not-preloaded.com", b"not-preloaded.com", b"not"
+    if suffixes is None:
+        in_place = _match_entries
+    else:
+        # The copying baseline only reads the entries of formats 1 and 2.
+        def in_place(bucket, host, suffix, label):
+            return _match_compact_entries(bucket, suffixes, host, suffix, label)
+
+    results = []
+    for bucket in reversed(largest):
+        decoded = _decode_bucket(bucket, suffixes)
+        copying_us, in_place_us, decode_us, decoded_us = [
+            None if func is None else timeit.timeit(func, number=200) / 200 * 1e6
+            for func in (
+                (
+                    None
+                    if suffixes is not None
+                    else lambda: _match_entries_copying(bucket, host, label)
+                ),
+                lambda: in_place(bucket, host, suffix, label),
+                lambda: _decode_bucket(bucket, suffixes),
+                lambda: _match_bucket(decoded, host, suffix, label),
+            )
+        ]
+        results.append(
+            {
+                "size": len(bucket),
+                "copying_us": copying_us,
+                "in_place_us": in_place_us,
+                "decode_us": decode_us,
+                "decoded_us": decoded_us,
+            }
+        )
+        print(
+            "%10d %12s %12.2f %12.2f %12.2f"
+            % (
+                len(bucket),
+                "-" if copying_us is None else "%.2f" % copying_us,
+                in_place_us,
+                decode_us,
+                decoded_us,
+            )
+        )
+    return results
+
+
+def bench_formats(corpus):
+    """Re-encodes the packaged list in each format with entries, and compares
+    the size of the data file and of its 'DATA' section and the time of
+    lookups that scan buckets in place or match decoded ones.
+    """
+    build = runpy.run_path(os.path.join(ROOT, "build-hstspreload.py"))
+    entries = [
+        {"name": name.decode("ascii"), "mode": "force-https", "include_subdomains": x}
+        for name, x in _iter_leaves()
+    ]
+    print(
+        "%8s %12s %12s  %s"
+        % ("format", "file (KB)", "DATA (KB)", "  ".join("%10s" % k for k in corpus))
+    )
+
+    data = _get_data()
+    results = {}
+    try:
+        for format_version in (2, 3, 4):
+            bin_layers, _ = build["encode_buckets"](entries, format_version)
+            encoded = build["encode_data"](
+                bin_layers, format_version, build["encode_bloom_filter"](bin_layers)
+            )
+            hstspreload._data = _parse_data(encoded)
+            hstspreload.set_cache_size(0)
+            lookups = {}
+            for kind, hosts in corpus.items():
+                clear_caches()
+                start = time.perf_counter()
+                for host in hosts:
+                    hstspreload.in_hsts_preload(host)
+                lookups[kind] = (time.perf_counter() - start) / len(hosts) * 1e6
+
+            _, _, sections = _parse_sections(encoded)
+            results[str(format_version)] = {
+                "file_bytes": len(encoded),
+                "data_bytes": len(sections[b"DATA"]),
+                "lookup_us": lookups,
+            }
+            print(
+                "%8d %12.1f %12.1f  %s"
+                % (
+                    format_version,
+                    len(encoded) / 1024,
+                    len(sections[b"DATA"]) / 1024,
+                    "  ".join("%10.2f" % lookups[k] for k in corpus),
+                )
+            )
+    finally:
+        hstspreload._data = data
+        hstspreload.set_cache_size(1024)
+        clear_caches()
+    return results
+
+
+def _upgrade_url_urlsplit(url):
+    # The straightforward way to upgrade a URL, kept as a baseline.
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme != "http" or not parts.hostname:
+        return url
+    if not hstspreload.in_hsts_preload(parts.hostname.encode("idna")):
+        return url
+    netloc = parts.netloc
+    if parts.port == 80:
+        netloc = netloc.rsplit(":", 1)[0]
+    return urllib.parse.urlunsplit(parts._replace(scheme="https", netloc=netloc))
+
+
+def bench_urls(hosts):
+    print("%16s %16s %16s" % ("urlsplit (us)", "upgrade_url", "upgrade_urls"))
+    urls = [
+        "http://%s%s/path?query=1" % (host.decode("ascii"), ":80" if i % 4 else "")
+        for i, host in enumerate(hosts[:10000])
+    ]
+    assert [_upgrade_url_urlsplit(url) for url in urls] == [
+        hstspreload.upgrade_url(url) for url in urls
+    ]
+
+    # Every result is cached so that only parsing the URLs is compared.
+    hstspreload.set_cache_size(None)
+    try:
+        timings = []
+        for func in (_upgrade_url_urlsplit, hstspreload.upgrade_url):
+            start = time.perf_counter()
+            for url in urls:
+                func(url)
+            timings.append((time.perf_counter() - start) / len(urls))
+    finally:
+        hstspreload.set_cache_size(1024)
+        clear_caches()
+
+    start = time.perf_counter()
+    hstspreload.upgrade_urls(urls)
+    timings.append((time.perf_counter() - start) / len(urls))
+
+    results = {
+        "urlsplit_us": timings[0] * 1e6,
+        "upgrade_url_us": timings[1] * 1e6,
+        "upgrade_urls_us": timings[2] * 1e6,
+    }
+    print("%16.2f %16.2f %16.2f" % tuple(t * 1e6 for t in timings))
+    return results
+
+
+def drop_page_cache():
+    """Asks the OS to drop the data file from the page cache, so that it's read
+    from disk again. Only has an effect while the file isn't mapped.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    path = os.path.join(os.path.dirname(hstspreload.__file__), "hstspreload.bin")
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+async def _measure_lag(hosts, lookup, tasks, interval=0.001):
+    """Looks up the hosts in concurrent tasks while timing how late a timer
+    on the same event loop fires. Returns the delays and the elapsed time.
+    """
+    loop = asyncio.get_running_loop()
+    lags = []
+    done = False
+
+    async def timer():
+        while not done:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lags.append(loop.time() - start - interval)
+
+    async def worker(hosts):
+        # Cached lookups don't yield, so yield after each one as a request
+        # handler would to give the other tasks a turn.
+        for host in hosts:
+            await lookup(host)
+            await asyncio.sleep(0)
+
+    timer_task = asyncio.ensure_future(timer())
+    await asyncio.sleep(interval)
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(hosts[i::tasks]) for i in range(tasks)])
+    elapsed = time.perf_counter() - start
+    done = True
+    await timer_task
+    return lags, elapsed
+
+
+def bench_event_loop(hosts, tasks=100):
+    """Compares the event loop lag of in_hsts_preload() called on the loop
+    with ain_hsts_preload(), starting with the data file closed and not in
+    the page cache, then again with it mapped and read.
+    """
+
+    async def sync_lookup(host):
+        hstspreload.in_hsts_preload(host)
+
+    print(
+        "%12s %12s %12s %12s %12s %14s"
+        % ("lookups", "start", "lag p50 (ms)", "lag p99", "max (ms)", "lookups/s")
+    )
+    hosts = hosts[:20000]
+    results = {}
+    for name, lookup in (
+        ("sync", sync_lookup),
+        ("async", hstspreload.ain_hsts_preload),
+    ):
+        hstspreload.close()
+        clear_caches()
+        drop_page_cache()
+        for start in ("cold", "warm"):
+            lags, elapsed = asyncio.run(_measure_lag(hosts, lookup, tasks))
+            clear_caches()
+            results["%s_%s" % (name, start)] = {
+                "lag_p50_ms": percentile(lags, 0.5) * 1e3,
+                "lag_p99_ms": percentile(lags, 0.99) * 1e3,
+                "lag_max_ms": max(lags) * 1e3,
+                "lookups_per_s": len(hosts) / elapsed,
+            }
+            print(
+                "%12s %12s %12.3f %12.3f %12.3f %14d"
+                % (
+                    name,
+                    start,
+                    percentile(lags, 0.5) * 1e3,
+                    percentile(lags, 0.99) * 1e3,
+                    max(lags) * 1e3,
+                    len(hosts) / elapsed,
+                )
+            )
+    return results
+
+
+def memory_kb():
+    """Returns the RSS and the private memory of this process, Linux only"""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if value.endswith("kB\n"):
+                fields[name] = int(value.split()[0])
+    return fields["Rss"], fields["Private_Clean"] + fields["Private_Dirty"]
+
+
+def _fork_worker(hosts):
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        hstspreload.set_cache_size(0)
+        for host in hosts:
+            hstspreload.in_hsts_preload(host)
+        os.write(write, b"%d %d" % memory_kb())
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read, "rb") as f:
+        rss, private = map(int, f.read().split())
+    os.waitpid(pid, 0)
+    return rss, private
+
+
+def _spawn_worker(hosts, env, setup=""):
+    script = (
+        "import sys, hstspreload\n"
+        "sys.path.insert(0, %r)\n"
+        "from importlib import import_module\n"
+        "bench = import_module('bench-hstspreload')\n"
+        "%s\n"
+        "hstspreload.set_cache_size(0)\n"
+        "for host in sys.stdin.buffer.read().split():\n"
+        "    hstspreload.in_hsts_preload(host)\n"
+        "print('%%d %%d' %% bench.memory_kb())" % (ROOT, setup)
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        input=b"\n".join(hosts),
+        capture_output=True,
+        check=True,
+        cwd=ROOT,
+        env=env,
+    ).stdout
+    return tuple(map(int, output.split()))
+
+
+def bench_workers(hosts, workers=4):
+    if not hasattr(os, "fork") or not os.path.exists("/proc/self/smaps_rollup"):
+        print("skipped, requires os.fork() and /proc/self/smaps_rollup")
+        return {}
+    print("%10s %10s %14s %14s" % ("engine", "start", "RSS (KB)", "private (KB)"))
+    hosts = hosts[:20000]
+    results = {}
+    try:
+        for engine in ("default", "index", "shared"):
+            hstspreload.unload_index()
+            os.environ.pop(hstspreload._INDEX_ENV, None)
+            if engine == "index":
+                hstspreload.load_index()
+            elif engine == "shared":
+                hstspreload.share_index()
+            else:
+                hstspreload.reopen()
+            hstspreload.in_hsts_preload("paypal.com")
+
+            # Spawned workers can't share an in-memory index, each loads its own.
+            env = dict(os.environ)
+            setup = "hstspreload.load_index()" if engine == "index" else ""
+            starts = {
+                "fork": lambda: _fork_worker(hosts),
+                "spawn": lambda: _spawn_worker(hosts, env, setup),
+            }
+            for start, run in starts.items():
+                memory = [run() for _ in range(workers)]
+                rss = sum(m[0] for m in memory) / workers
+                private = sum(m[1] for m in memory) / workers
+                results["%s-%s" % (engine, start)] = {
+                    "rss_kb": rss,
+                    "private_kb": private,
+                }
+                print("%10s %10s %14d %14d" % (engine, start, rss, private))
+    finally:
+        hstspreload.unload_index()
+        os.environ.pop(hstspreload._INDEX_ENV, None)
+    return results
+
+
+def write_snapshot(path):
+    """Writes the packaged list in the format of the Chromium preload list"""
+    entries = []
+    for name, include in _iter_leaves():
+        entry = {"name": name.decode("ascii"), "mode": "force-https"}
+        if include:
+            entry["include_subdomains"] = True
+        entries.append(entry)
+    entries.sort(key=lambda entry: entry["name"])
+    with open(path, "w") as f:
+        f.write("// Snapshot of the list in hstspreload.bin\n")
+        json.dump({"entries": entries}, f, indent=1)
+
+
+def lookup_sections(content):
+    """The sections of a data file apart from the version and checksum of its list"""
+    _, _, sections = hstspreload._parse_sections(content)
+    sections.pop(b"META", None)
+    return {name: bytes(section) for name, section in sections.items()}
+
+
+def bench_build(snapshot=None):
+    print("%10s %12s %12s" % ("entries", "build (s)", "identical"))
+    with tempfile.TemporaryDirectory() as tmp:
+        if snapshot is None:
+            snapshot = os.path.join(tmp, "snapshot.json")
+            write_snapshot(snapshot)
+        output = os.path.join(tmp, "hstspreload.bin")
+
+        start = time.perf_counter()
+        subprocess.run(
+            [
+                sys.executable,
+                os.path.join(ROOT, "build-hstspreload.py"),
+                "--snapshot",
+                snapshot,
+                "--output",
+                output,
+            ],
+            check=True,
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+        )
+        build = time.perf_counter() - start
+
+        with open(snapshot) as f:
+            entries = f.read().count('"name"')
+        with open(output, "rb") as f:
+            built = f.read()
+        with open(os.path.join(ROOT, "hstspreload", "hstspreload.bin"), "rb") as f:
+            identical = lookup_sections(built) == lookup_sections(f.read())
+
+    results = {"entries": entries, "build_s": build, "identical": identical}
+    print("%10d %12.2f %12s" % (entries, build, identical))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help="benchmarks to run out of %s, defaults to all" % ", ".join(BENCHMARKS),
+    )
+    parser.add_argument(
+        "--json", help="also write the results as JSON to this path, '-' for stdout"
+    )
+    parser.add_argument(
+        "--size", type=int, default=2000, help="hosts of each kind in the corpus"
+    )
+    parser.add_argument(
+        "--snapshot",
+        help="preload list JSON to time the build with, "
+        "defaults to a snapshot of hstspreload.bin",
+    )
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+    benchmarks = args.benchmarks or BENCHMARKS
+
+    corpus = load_corpus(args.size)
+    hosts = mixed_hosts(corpus, max(BATCH_SIZES))
+    runs = {
+        "import": bench_import,
+        "single": lambda: bench_single(corpus),
+        "rules": bench_rules,
+        "batches": lambda: bench_batches(hosts),
+        "engines": lambda: bench_engines(hosts),
+        "bloom_filter": bench_bloom_filter,
+        "buckets": bench_buckets,
+        "formats": lambda: bench_formats(corpus),
+        "urls": lambda: bench_urls(hosts),
+        "event_loop": lambda: bench_event_loop(hosts),
+        "workers": lambda: bench_workers(hosts),
+        "build": lambda: bench_build(args.snapshot),
+    }
+
+    # Keep stdout for the JSON if it's written there.
+    log = sys.stderr if args.json == "-" else sys.stdout
+    results = {}
+    with contextlib.redirect_stdout(log):
+        for name in benchmarks:
+            print("== %s" % name)
+            results[name] = runs[name]()
+            print()
+
+    if args.json:
+        report = {
+            "hstspreload": {
+                "version": hstspreload.__version__,
+                "checksum": hstspreload.__checksum__,
+                "format": _get_data().version,
+            },
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "corpus_size": args.size,
+            "results": results,
+        }
+        if args.json == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,37 @@
 """Builds the hstspreload.bin file"""
 
+import argparse
 import base64
+import collections
 import datetime
 import hashlib
 import json
+import os
 import re
 import struct
 import sys
 
-import urllib3
-
-from hstspreload import _INCLUDE_SUBDOMAINS, _IS_LEAF, _crc8
+from hstspreload import (
+    _BLOOM,
+    _DELTA_MAGIC,
+    _DELTA_VERSION,
+    _FORMAT_VERSION,
+    _INCLUDE_SUBDOMAINS,
+    _IS_LEAF,
+    _LABEL_SIZE,
+    _MAGIC,
+    _PATCH,
+    _RUN,
+    _bloom_hashes,
+    _bucket_key,
+    _encode_bucket_sections,
+    _encode_sections,
+    _iter_buckets,
+    _iter_entries,
+    _iter_leaves,
+    _parse_data,
+    _parse_sections,
+)
 
 HSTS_PRELOAD_URL = (
     "https://chromium.googlesource.com/chromium/src/+/main/"
@@ -18,14 +39,210 @@ HSTS_PRELOAD_URL = (
 )
 VERSION_RE = re.compile(r"^__version__\s+=\s+\"[\d.]+\"", re.MULTILINE)
 CHECKSUM_RE = re.compile(r"^__checksum__\s+=\s+\"([a-f0-9]*)\"", re.MULTILINE)
-JUMPTABLE_RE = re.compile(r"^_JUMPTABLE\s+=\s+[^\n]+$", re.MULTILINE)
 GTLD_INCLUDE_SUBDOMAINS_RE = re.compile(
     r"^_GTLD_INCLUDE_SUBDOMAINS\s+=\s+[^\n]+$", re.MULTILINE
 )
+# 12 bits and 8 hashes per host gives a false positive rate of ~0.3% for each
+# name checked against the Bloom filter. Lookups check the host and each of
+# its parent domains, so ~1% of three label hosts that aren't preloaded
+# make it past the filter. There are no false negatives.
+BLOOM_BITS_PER_HOST = 12
+BLOOM_HASHES = 8
+# The filter grows in steps of 8KB so that its size, and with it the position
+# of every bit, stays the same across small changes to the list. Deltas then
+# only carry the bytes of the bits that changed.
+BLOOM_BITS_STEP = 1 << 16
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--snapshot",
+        help="read the preload list from this file instead of downloading it, "
+        "either the JSON or the base64 text served by googlesource",
+    )
+    parser.add_argument(
+        "--output",
+        help="write hstspreload.bin to this path and leave the package unchanged",
+    )
+    parser.add_argument(
+        "--version",
+        help="version of the build, defaults to the date of SOURCE_DATE_EPOCH "
+        "or today",
+    )
+    parser.add_argument(
+        "--previous",
+        default=os.path.join("hstspreload", "hstspreload.bin"),
+        help="data file of the previous build to compare with "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="copy buckets whose entries didn't change from the previous data "
+        "file instead of encoding them again",
+    )
+    parser.add_argument(
+        "--delta",
+        help="also write a delta from the previous data file to the new one "
+        "to this path, see hstspreload.apply_delta()",
+    )
+    parser.add_argument(
+        "--diff",
+        help="write the hosts added, removed and changed since the previous "
+        "data file as JSON to this path, '-' for stdout",
+    )
+    args = parser.parse_args(argv)
+    # Keep stdout for the diff if it's written there.
+    log = sys.stderr if args.diff == "-" else sys.stdout
+
+    if args.snapshot:
+        print("Reading HSTS preload list from %s..." % args.snapshot, file=log)
+        with open(args.snapshot, "rb") as f:
+            content = f.read()
+        if not content.lstrip().startswith((b"{", b"/")):
+            content = base64.b64decode(content)
+    else:
+        print("Downloading latest HSTS preload list...", file=log)
+        content = download_list()
+    content_checksum = hashlib.sha256(content).hexdigest()
+    content = content.decode("ascii")
+    print("Checksum of list is: %s" % content_checksum, file=log)
 
+    if not args.output:
+        with open("hstspreload/__init__.py", "r") as f:
+            data = f.read()
+        current_checksum = CHECKSUM_RE.search(data).group(1)
+        print("Checksum of current list is: %s" % current_checksum, file=log)
+        if current_checksum == content_checksum:
+            print(
+                "Detected no changes to HSTS preload list, cancelling build...",
+                file=log,
+            )
+            return 1
+
+    print("Parsing HSTS preload entries...", file=log)
+    entries = parse_entries(content)
+    hosts = preloaded_hosts(entries)
+    gtld_include_subdomains = {
+        name for name, include in hosts.items() if include and b"." not in name
+    }
+    version = args.version or build_version()
+
+    previous = previous_content = None
+    if os.path.exists(args.previous):
+        print("Reading previous data file %s..." % args.previous, file=log)
+        with open(args.previous, "rb") as f:
+            previous_content = f.read()
+        previous = _parse_data(previous_content)
+    elif args.delta:
+        parser.error("--delta needs the data file given with --previous")
+    changes = diff_hosts(
+        {} if previous is None else dict(_iter_leaves(previous)), hosts
+    )
+    print(
+        "%d hosts added, %d removed and %d changed"
+        % tuple(len(changes[x]) for x in ("added", "removed", "changed")),
+        file=log,
+    )
+    if args.diff:
+        diff = {
+            "previous": (
+                None
+                if previous is None or previous.meta is None
+                else dict(zip(("version", "checksum"), previous.meta))
+            ),
+            "version": version,
+            "checksum": content_checksum,
+            **changes,
+        }
+        if args.diff == "-":
+            json.dump(diff, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.diff, "w") as f:
+                json.dump(diff, f, indent=2)
+
+    if args.incremental and (previous is None or previous.version != _FORMAT_VERSION):
+        print("No previous data file in this format, encoding every bucket", file=log)
+        previous = None
+    if args.incremental and previous is not None:
+        keys = changed_buckets(changes)
+        print("Encoding labels of %d changed buckets..." % len(keys), file=log)
+        bin_layers, _ = encode_buckets(entries, keys=keys)
+    else:
+        keys = ()
+        print("Encoding labels into binary...", file=log)
+        bin_layers, _ = encode_buckets(entries)
+        print_bucket_stats(bin_layers, file=log)
+        previous = None
+
+    print("Encoding preloaded hosts into Bloom filter...", file=log)
+    bloom_filter = encode_hosts_bloom_filter(hosts)
+    print("Bloom filter is %d bytes" % len(bloom_filter), file=log)
+
+    output = args.output or "hstspreload/hstspreload.bin"
+    print("Writing jump table and data into %s..." % output, file=log)
+    encoded = encode_data(
+        bin_layers,
+        bloom_filter=bloom_filter,
+        meta=(version, content_checksum),
+        previous=previous,
+        changed=keys,
+    )
+    with open(output, "wb") as f:
+        f.truncate()
+        f.write(encoded)
+    if args.delta:
+        delta = encode_delta(previous_content, encoded)
+        print(
+            "Writing delta of %d bytes into %s..." % (len(delta), args.delta), file=log
+        )
+        with open(args.delta, "wb") as f:
+            f.write(delta)
+    if args.output:
+        return 0
+
+    print(
+        "Updating __version__, __checksum__ and _GTLD_INCLUDE_SUBDOMAINS...", file=log
+    )
+    with open("hstspreload/__init__.py", "r") as f:
+        data = f.read()
+    # render the gtld subdomains in sorted order
+    str_gtld_include_subdomains = (
+        "{" + ", ".join([str(e) for e in sorted(gtld_include_subdomains)]) + "}"
+    )
+    data = VERSION_RE.sub('__version__ = "%s"' % version, data, re.M)
+    data = CHECKSUM_RE.sub('__checksum__ = "%s"' % content_checksum, data)
+    data = GTLD_INCLUDE_SUBDOMAINS_RE.sub(
+        "_GTLD_INCLUDE_SUBDOMAINS = %s  # noqa: E501" % str_gtld_include_subdomains,
+        data,
+    )
+    with open("hstspreload/__init__.py", "w") as f:
+        f.truncate()
+        f.write(data)
+
+    return 0
+
+
+def build_version():
+    """Returns the version for the date in SOURCE_DATE_EPOCH, else for today,
+    so that rebuilding the same list gives the same output.
+    """
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if epoch:
+        date = datetime.datetime.fromtimestamp(
+            int(epoch), tz=datetime.timezone.utc
+        ).date()
+    else:
+        date = datetime.date.today()
+    return "%d.%d.%d" % (date.year, date.month, date.day)
+
+
+def download_list():
+    """Downloads the preload list JSON from the Chromium repository"""
+    import urllib3
 
-def main():
-    print("Downloading latest HSTS preload list...")
     http = urllib3.PoolManager()
     r = http.request(
         "GET",
@@ -33,26 +250,60 @@ def main():
         headers={"Accept": "application/json"},
         preload_content=True,
     )
-    content = base64.b64decode(r.data)
-    content_checksum = hashlib.sha256(content).hexdigest()
-    content = content.decode("ascii")
-    print("Checksum of downloaded list is: %s" % content_checksum)
+    return base64.b64decode(r.data)
 
-    with open("hstspreload/__init__.py", "r") as f:
-        data = f.read()
-    current_checksum = CHECKSUM_RE.search(data).group(1)
-    print("Checksum of current list is: %s" % current_checksum)
-    if current_checksum == content_checksum:
-        print("Detected no changes to HSTS preload list, cancelling build...")
-        return 1
-
-    print("Parsing HSTS preload entries...")
-    entries = json.loads(
+
+def parse_entries(content):
+    """Parses the entries out of the JSON preload list, which has comments"""
+    return json.loads(
         "\n".join(
             [line for line in content.split("\n") if not line.strip().startswith("//")]
         )
     )["entries"]
 
+
+def preloaded_hosts(entries):
+    """Maps the names of the force-https entries to their include_subdomains.
+    Lookups stop after five labels, so deeper names are left out.
+    """
+    hosts = {}
+    for entry in entries:
+        name = entry["name"].encode("ascii")
+        if entry.get("mode", "") == "force-https" and name.count(b".") < 5:
+            hosts[name] = entry.get("include_subdomains", False)
+    return hosts
+
+
+def diff_hosts(previous, hosts):
+    """Compares two results of preloaded_hosts(), hosts whose include_subdomains
+    flipped are 'changed'.
+    """
+    return {
+        "added": sorted(x.decode("ascii") for x in hosts.keys() - previous.keys()),
+        "removed": sorted(x.decode("ascii") for x in previous.keys() - hosts.keys()),
+        "changed": sorted(
+            x.decode("ascii")
+            for x in hosts.keys() & previous.keys()
+            if hosts[x] != previous[x]
+        ),
+    }
+
+
+def changed_buckets(changes, format_version=_FORMAT_VERSION):
+    """Returns the keys of the buckets with entries of the hosts in a diff"""
+    keys = set()
+    for names in changes.values():
+        for name in names:
+            for i, label in enumerate(name.encode("ascii").split(b".")[::-1]):
+                keys.add(_bucket_key(format_version, i, label))
+    return keys
+
+
+def encode_buckets(entries, format_version=_FORMAT_VERSION, keys=None):
+    """Encodes the force-https entries into buckets keyed by (layer, bucket key),
+    only the buckets in 'keys' if it's given. Also returns the gTLDs which
+    include all their subdomains.
+    """
     layers = {}
     gtld_include_subdomains = set()
 
@@ -62,11 +313,14 @@ def main():
         include_subdomains = entry.get("include_subdomains", False)
         force_https = entry.get("mode", "") == "force-https"
 
-        if force_https:
+        # Lookups never get past the fifth label.
+        if force_https and len(labels) <= 5:
             for i, label in enumerate(labels):
                 is_leaf = i == (len(labels) - 1)
-                checksum = _crc8(label)
-                labs = layers.setdefault((i, checksum), set())
+                key = _bucket_key(format_version, i, label)
+                if keys is not None and key not in keys:
+                    continue
+                labs = layers.setdefault((i, key), set())
                 labs.add(
                     (
                         is_leaf,
@@ -77,72 +331,218 @@ def main():
                 if i == 0 and is_leaf and include_subdomains:
                     gtld_include_subdomains.add(name)
 
-    print("Encoding labels into binary...")
     bin_layers = {}
-    for layer in range(5):
-        for checksum in range(256):
-            chunks = []
-            for is_leaf, include_subdomains, label in sorted(
-                layers.get((layer, checksum), []),
-                key=lambda x: (not x[0], x[1], 256 - len(x[2]), x[2]),
-            ):
-                flags = 0x00
-                if is_leaf:
-                    flags |= _IS_LEAF
-                if include_subdomains:
-                    flags |= _INCLUDE_SUBDOMAINS
-                if len(label) > 0xFF:
-                    raise ValueError("label too long for encoding scheme: %r" % label)
-                chunks.append(struct.pack("<BB", flags, len(label)) + label)
-
-            bin_layers[(layer, checksum)] = b"".join(chunks)
-
-    print("Encoding layer offsets into jump table...")
-    jump_table = []
-    current_offset = 0
-    for layer in range(5):
-        jump_table_for_layer = []
-        for checksum in range(256):
-            bin_layer = bin_layers[(layer, checksum)]
-            if not bin_layer:
-                jump_table_for_layer.append(None)
-            else:
-                layer_len = len(bin_layer)
-                jump_table_for_layer.append((current_offset, layer_len))
-                current_offset += layer_len
-        jump_table.append(jump_table_for_layer)
-
-    print("Writing data into hstspreload.bin...")
-    with open("hstspreload/hstspreload.bin", "wb") as f:
-        f.truncate()
-        for layer in range(5):
-            for checksum in range(256):
-                f.write(bin_layers[(layer, checksum)])
+    for (layer, key), labs in layers.items():
+        chunks = []
+        for is_leaf, include_subdomains, label in sorted(
+            labs, key=lambda x: (not x[0], x[1], 256 - len(x[2]), x[2])
+        ):
+            flags = 0x00
+            if is_leaf:
+                flags |= _IS_LEAF
+            if include_subdomains:
+                flags |= _INCLUDE_SUBDOMAINS
+            if len(label) > 0xFF:
+                raise ValueError("label too long for encoding scheme: %r" % label)
+            chunks.append(struct.pack("<BB", flags, len(label)) + label)
 
-    print(
-        "Updating __version__, __checksum__, _JUMPTABLE and _GTLD_INCLUDE_SUBDOMAINS..."
-    )
-    with open("hstspreload/__init__.py", "r") as f:
-        data = f.read()
-    today = datetime.date.today()
-    # render the gtld subdomains in sorted order
-    str_gtld_include_subdomains = (
-        "{" + ", ".join([str(e) for e in sorted(gtld_include_subdomains)]) + "}"
+        bin_layers[(layer, key)] = b"".join(chunks)
+
+    return bin_layers, gtld_include_subdomains
+
+
+def encode_bloom_filter(bin_layers):
+    """Encodes a Bloom filter of every preloaded host in the buckets"""
+    hosts = []
+    for data in bin_layers.values():
+        for flags, start, end in _iter_entries(data):
+            if flags & _IS_LEAF:
+                hosts.append(data[start:end])
+    return encode_hosts_bloom_filter(hosts)
+
+
+def encode_hosts_bloom_filter(hosts):
+    """Encodes a Bloom filter of the given host names"""
+    bits = -(-len(hosts) * BLOOM_BITS_PER_HOST // BLOOM_BITS_STEP) * BLOOM_BITS_STEP
+    bits = max(bits, BLOOM_BITS_STEP)
+    bitarray = bytearray((bits + 7) // 8)
+    for host in hosts:
+        h1, h2 = _bloom_hashes(host)
+        for i in range(BLOOM_HASHES):
+            bit = (h1 + i * h2) % bits
+            bitarray[bit >> 3] |= 1 << (bit & 7)
+    return _BLOOM.pack(BLOOM_HASHES, bits) + bytes(bitarray)
+
+
+def encode_data(
+    bin_layers,
+    format_version=_FORMAT_VERSION,
+    bloom_filter=None,
+    meta=None,
+    previous=None,
+    changed=(),
+):
+    """Encodes buckets from encode_buckets() into the contents of hstspreload.bin,
+    'meta' is the version and checksum of the list. Buckets of the parsed data
+    file 'previous' are copied unless their key is in 'changed', it has to be
+    in the same format.
+    """
+    buckets = {key: data for (_, key), data in bin_layers.items()}
+    if format_version > 2:
+        buckets, suffixes = encode_compact_buckets(
+            buckets, () if previous is None else previous.suffixes
+        )
+    if previous is not None:
+        for key, data in _iter_buckets(previous):
+            if key not in changed:
+                buckets[key] = bytes(data)
+
+    sections = _encode_bucket_sections(format_version, buckets)
+    if format_version > 2:
+        sections.append((b"SUFX", suffixes))
+    if bloom_filter is not None:
+        sections.append((b"BLOM", bloom_filter))
+    if meta is not None:
+        sections.append((b"META", ("%s\n%s" % meta).encode("ascii")))
+
+    return _encode_sections(_MAGIC, format_version, sections)
+
+
+def encode_delta(previous_content, content):
+    """Encodes a delta that turns the data file 'previous_content' into
+    'content', both have to be of the same format and have a 'META' section.
+    """
+    previous = _parse_data(previous_content)
+    data = _parse_data(content)
+    if previous.version != data.version or previous.meta is None:
+        raise ValueError("can only encode deltas between data files of one format")
+
+    previous_buckets = dict(_iter_buckets(previous))
+    buckets = dict(_iter_buckets(data))
+    keys = sorted(
+        key
+        for key in previous_buckets.keys() | buckets.keys()
+        if previous_buckets.get(key, b"") != buckets.get(key, b"")
     )
-    data = VERSION_RE.sub(
-        '__version__ = "%d.%d.%d"' % (today.year, today.month, today.day), data, re.M
+    offsets = [0]
+    for key in keys:
+        offsets.append(offsets[-1] + len(buckets.get(key, b"")))
+
+    _, _, previous_sections = _parse_sections(previous_content)
+    _, _, sections = _parse_sections(content)
+    patches = []
+    for tag, section in sections.items():
+        if tag in (b"KEYS", b"LAYR", b"JUMP", b"HIGH", b"DATA"):
+            continue
+        runs = diff_runs(bytes(previous_sections.get(tag, b"")), bytes(section))
+        patches.append(_PATCH.pack(tag, len(section), len(runs)))
+        for start, run in runs:
+            patches.append(_RUN.pack(start, len(run)) + run)
+
+    return _encode_sections(
+        _DELTA_MAGIC,
+        _DELTA_VERSION,
+        [
+            (
+                b"FROM",
+                (
+                    "%s\n%s"
+                    % (previous.meta[1], hashlib.sha256(previous_content).hexdigest())
+                ).encode("ascii"),
+            ),
+            (b"HASH", hashlib.sha256(content).hexdigest().encode("ascii")),
+            (b"KEYS", struct.pack("<%dI" % len(keys), *keys)),
+            (b"OFFS", struct.pack("<%dI" % len(offsets), *offsets)),
+            (b"DATA", b"".join(buckets.get(key, b"") for key in keys)),
+            (b"PTCH", b"".join(patches)),
+        ],
     )
-    data = CHECKSUM_RE.sub('__checksum__ = "%s"' % content_checksum, data)
-    data = JUMPTABLE_RE.sub("_JUMPTABLE = %s  # noqa: E501" % str(jump_table), data)
-    data = GTLD_INCLUDE_SUBDOMAINS_RE.sub(
-        "_GTLD_INCLUDE_SUBDOMAINS = %s  # noqa: E501" % str_gtld_include_subdomains,
-        data,
+
+
+def diff_runs(previous, section, gap=8):
+    """Returns (offset, bytes) runs of 'section' that differ from 'previous',
+    runs less than 'gap' bytes apart are merged.
+    """
+    runs = []
+    start = end = None
+    for offset in range(len(section)):
+        if offset < len(previous) and previous[offset] == section[offset]:
+            continue
+        if end is not None and offset - end < gap:
+            end = offset + 1
+            continue
+        if start is not None:
+            runs.append((start, section[start:end]))
+        start, end = offset, offset + 1
+    if start is not None:
+        runs.append((start, section[start:end]))
+    return runs
+
+
+def encode_compact_buckets(buckets, previous_suffixes=()):
+    """Re-encodes buckets for format 3, where leaves refer to their parent
+    domain in a table of suffixes instead of repeating it. The table starts
+    with 'previous_suffixes' so that buckets encoded with them stay valid.
+    Returns the buckets and the table.
+    """
+    parents = collections.Counter()
+    for data in buckets.values():
+        for flags, start, end in _iter_entries(data):
+            if flags & _IS_LEAF:
+                parents[data[start:end].partition(b".")[2]] += 1
+    # The most used suffixes get the positions that fit in one byte.
+    suffixes = list(previous_suffixes) + sorted(
+        parents.keys() - set(previous_suffixes), key=lambda x: (-parents[x], x)
     )
-    with open("hstspreload/__init__.py", "w") as f:
-        f.truncate()
-        f.write(data)
+    if len(suffixes) > 0x4000:
+        raise ValueError("too many suffixes for encoding scheme")
+    positions = {suffix: i for i, suffix in enumerate(suffixes)}
 
-    return 0
+    compact = {}
+    for key, data in buckets.items():
+        chunks = []
+        for flags, start, end in _iter_entries(data):
+            label, _, parent = data[start:end].partition(b".")
+            if len(label) > _LABEL_SIZE:
+                raise ValueError("label too long for encoding scheme: %r" % label)
+            chunks.append(bytes([flags | len(label)]) + label)
+            if flags & _IS_LEAF:
+                position = positions[parent]
+                if position < 0x80:
+                    chunks.append(bytes([position]))
+                else:
+                    chunks.append(bytes([position & 0x7F | 0x80, position >> 7]))
+        compact[key] = b"".join(chunks)
+
+    for suffix in suffixes:
+        if len(suffix) > 0xFF:
+            raise ValueError("suffix too long for encoding scheme: %r" % suffix)
+    return compact, b"".join(bytes([len(x)]) + x for x in suffixes)
+
+
+def print_bucket_stats(bin_layers, file=None):
+    print("Bucket sizes in bytes:", file=file)
+    print(
+        "%8s %8s %10s %8s %8s %8s"
+        % ("layer", "buckets", "bytes", "mean", "p99", "max"),
+        file=file,
+    )
+    for layer in range(5):
+        sizes = sorted(len(data) for (i, _), data in bin_layers.items() if i == layer)
+        if not sizes:
+            continue
+        print(
+            "%8d %8d %10d %8.1f %8d %8d"
+            % (
+                layer,
+                len(sizes),
+                sum(sizes),
+                sum(sizes) / len(sizes),
+                sizes[int(len(sizes) * 0.99)],
+                sizes[-1],
+            ),
+            file=file,
+        )
 
 
 if __name__ == "__main__":
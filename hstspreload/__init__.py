@@ -1,16 +1,53 @@
 """Check if a host is in the Google Chrome HSTS Preload list"""
 
+import collections
 import functools
+import mmap
 import os
+import struct
+import sys
+import threading
+import time
 import typing
+import zlib
+from bisect import bisect_left, bisect_right
+
+if typing.TYPE_CHECKING:
+    import concurrent.futures
 
 __version__ = "2026.6.1"
 __checksum__ = "62e8a8b529342dfdc81f3fd48e00a653f6eb741d65b33a1be833780d7ca38965"
-__all__ = ["in_hsts_preload"]
+__all__ = [
+    "in_hsts_preload",
+    "in_hsts_preload_many",
+    "ain_hsts_preload",
+    "ain_hsts_preload_many",
+    "lookup",
+    "LookupResult",
+    "should_upgrade",
+    "upgrade_url",
+    "upgrade_urls",
+    "CacheInfo",
+    "cache_info",
+    "cache_clear",
+    "set_cache_size",
+    "LookupStats",
+    "LookupHistograms",
+    "set_lookup_hook",
+    "load_dataset",
+    "dataset_info",
+    "DatasetInfo",
+    "apply_delta",
+    "load_index",
+    "unload_index",
+    "share_index",
+    "attach_index",
+    "close",
+    "reopen",
+]
 
 # fmt: off
 _GTLD_INCLUDE_SUBDOMAINS = {b'amazon', b'android', b'app', b'audible', b'azure', b'bank', b'bing', b'boo', b'channel', b'chrome', b'dad', b'day', b'dev', b'eat', b'esq', b'fire', b'fly', b'foo', b'fujitsu', b'gle', b'gmail', b'google', b'hangout', b'hotmail', b'imdb', b'ing', b'insurance', b'kindle', b'meet', b'meme', b'microsoft', b'mov', b'new', b'nexus', b'office', b'page', b'phd', b'play', b'prime', b'prof', b'rsvp', b'search', b'silk', b'skype', b'windows', b'xbox', b'xn--cckwcxetd', b'xn--jlq480n2rg', b'youtube', b'zappos', b'zip'}  # noqa: E501
-_JUMPTABLE = [[(0, 4), (4, 10), (14, 19), (33, 42), (75, 35), (110, 12), (122, 8), (130, 19), (149, 22), (171, 7), (178, 13), (191, 25), None, (216, 23), (239, 37), (276, 19), (295, 17), (312, 36), (348, 14), (362, 10), (372, 18), None, (390, 51), (441, 8), (449, 34), (483, 19), (502, 13), (515, 14), (529, 7), None, None, (536, 33), (569, 20), (589, 25), (614, 14), (628, 14), (642, 28), None, (670, 18), (688, 30), None, (718, 13), (731, 10), (741, 8), (749, 17), None, (766, 26), (792, 16), (808, 5), (813, 10), (823, 14), (837, 11), (848, 12), (860, 27), (887, 7), (894, 11), (905, 5), (910, 5), (915, 20), (935, 8), (943, 27), (970, 46), (1016, 25), (1041, 16), (1057, 8), (1065, 5), (1070, 22), (1092, 18), None, (1110, 32), (1142, 15), (1157, 24), (1181, 11), None, (1192, 10), (1202, 19), (1221, 18), (1239, 18), (1257, 5), (1262, 20), (1282, 26), (1308, 35), (1343, 19), (1362, 20), (1382, 46), (1428, 14), (1442, 14), (1456, 8), (1464, 13), (1477, 10), (1487, 13), (1500, 20), (1520, 19), None, (1539, 13), (1552, 26), (1578, 11), (1589, 4), (1593, 22), (1615, 19), (1634, 15), (1649, 14), (1663, 19), (1682, 11), (1693, 21), (1714, 12), (1726, 25), None, (1751, 10), (1761, 14), (1775, 26), (1801, 45), (1846, 15), None, (1861, 11), (1872, 30), (1902, 21), (1923, 26), (1949, 6), (1955, 6), (1961, 14), (1975, 5), (1980, 30), (2010, 23), (2033, 6), (2039, 13), (2052, 8), (2060, 28), (2088, 12), (2100, 59), (2159, 44), (2203, 12), (2215, 23), (2238, 16), (2254, 14), None, (2268, 24), (2292, 32), (2324, 6), (2330, 41), (2371, 22), (2393, 23), (2416, 23), (2439, 12), (2451, 8), (2459, 24), (2483, 12), (2495, 32), (2527, 25), (2552, 15), None, (2567, 46), (2613, 28), (2641, 13), (2654, 18), (2672, 26), (2698, 5), (2703, 42), (2745, 30), (2775, 16), (2791, 33), (2824, 17), (2841, 23), (2864, 21), (2885, 25), (2910, 19), (2929, 10), (2939, 7), (2946, 37), (2983, 6), (2989, 18), (3007, 32), (3039, 27), (3066, 17), (3083, 30), (3113, 12), (3125, 28), (3153, 35), (3188, 12), (3200, 57), (3257, 32), (3289, 25), None, (3314, 8), (3322, 25), (3347, 18), (3365, 6), (3371, 23), (3394, 9), (3403, 36), (3439, 23), (3462, 14), (3476, 16), (3492, 22), None, (3514, 20), (3534, 45), (3579, 34), (3613, 15), (3628, 20), (3648, 21), (3669, 21), (3690, 32), (3722, 24), (3746, 20), (3766, 10), (3776, 52), (3828, 6), (3834, 9), (3843, 12), (3855, 18), (3873, 5), (3878, 10), (3888, 39), (3927, 36), None, (3963, 25), (3988, 28), None, (4016, 19), (4035, 8), (4043, 17), None, (4060, 25), (4085, 17), None, (4102, 21), (4123, 35), (4158, 21), (4179, 10), (4189, 48), (4237, 11), (4248, 37), (4285, 46), (4331, 23), (4354, 12), (4366, 14), (4380, 23), (4403, 20), (4423, 14), (4437, 8), (4445, 47), (4492, 38), None, None, (4530, 47), (4577, 42), None, (4619, 18), None, (4637, 20), (4657, 8), (4665, 34), (4699, 6), (4705, 40), (4745, 22)], [(4767, 5456), (10223, 5452), (15675, 5966), (21641, 6072), (27713, 6060), (33773, 5229), (39002, 5845), (44847, 5445), (50292, 5299), (55591, 5117), (60708, 5453), (66161, 5752), (71913, 5107), (77020, 5872), (82892, 5479), (88371, 5664), (94035, 5241), (99276, 4843), (104119, 5211), (109330, 5070), (114400, 5327), (119727, 5525), (125252, 5989), (131241, 5142), (136383, 5706), (142089, 5103), (147192, 5247), (152439, 5611), (158050, 5466), (163516, 5808), (169324, 5204), (174528, 5942), (180470, 5426), (185896, 5196), (191092, 5147), (196239, 6059), (202298, 5411), (207709, 6099), (213808, 6011), (219819, 5840), (225659, 6515), (232174, 5002), (237176, 5631), (242807, 5254), (248061, 4921), (252982, 5715), (258697, 4928), (263625, 5925), (269550, 5048), (274598, 5373), (279971, 5799), (285770, 5148), (290918, 5328), (296246, 5557), (301803, 5107), (306910, 5242), (312152, 5925), (318077, 5982), (324059, 5632), (329691, 5135), (334826, 5178), (340004, 5778), (345782, 5632), (351414, 5660), (357074, 6314), (363388, 4734), (368122, 5378), (373500, 5918), (379418, 5750), (385168, 4991), (390159, 5233), (395392, 5624), (401016, 5061), (406077, 5503), (411580, 5342), (416922, 5906), (422828, 5381), (428209, 5404), (433613, 5789), (439402, 5016), (444418, 5456), (449874, 5287), (455161, 5017), (460178, 5288), (465466, 5592), (471058, 5556), (476614, 5914), (482528, 5144), (487672, 4944), (492616, 5612), (498228, 5967), (504195, 5877), (510072, 4968), (515040, 5098), (520138, 5217), (525355, 5128), (530483, 5368), (535851, 4854), (540705, 5838), (546543, 5325), (551868, 5417), (557285, 5149), (562434, 5460), (567894, 5301), (573195, 4662), (577857, 5297), (583154, 5687), (588841, 5560), (594401, 5280), (599681, 4668), (604349, 5613), (609962, 5293), (615255, 4917), (620172, 5643), (625815, 5649), (631464, 5227), (636691, 5748), (642439, 4891), (647330, 5637), (652967, 5747), (658714, 6205), (664919, 5080), (669999, 5595), (675594, 5459), (681053, 5454), (686507, 6034), (692541, 5570), (698111, 5191), (703302, 5203), (708505, 5552), (714057, 5763), (719820, 5301), (725121, 5319), (730440, 5115), (735555, 5133), (740688, 5926), (746614, 5710), (752324, 6151), (758475, 5573), (764048, 5610), (769658, 6140), (775798, 5765), (781563, 5778), (787341, 5904), (793245, 5686), (798931, 4978), (803909, 5584), (809493, 5693), (815186, 5007), (820193, 5381), (825574, 5313), (830887, 5488), (836375, 4997), (841372, 5114), (846486, 5450), (851936, 5356), (857292, 5215), (862507, 5185), (867692, 5526), (873218, 5032), (878250, 5418), (883668, 5449), (889117, 5558), (894675, 5397), (900072, 5236), (905308, 5863), (911171, 5586), (916757, 4731), (921488, 5908), (927396, 5421), (932817, 5134), (937951, 5526), (943477, 5329), (948806, 5855), (954661, 5441), (960102, 5398), (965500, 5932), (971432, 4931), (976363, 5166), (981529, 5086), (986615, 7271), (993886, 5649), (999535, 5871), (1005406, 5571), (1010977, 5841), (1016818, 5293), (1022111, 5060), (1027171, 6104), (1033275, 5389), (1038664, 5539), (1044203, 5751), (1049954, 4973), (1054927, 5423), (1060350, 4849), (1065199, 5638), (1070837, 5796), (1076633, 5115), (1081748, 5056), (1086804, 5056), (1091860, 5413), (1097273, 5650), (1102923, 5957), (1108880, 5696), (1114576, 5071), (1119647, 5455), (1125102, 5816), (1130918, 5920), (1136838, 5449), (1142287, 5581), (1147868, 5351), (1153219, 6486), (1159705, 5342), (1165047, 5436), (1170483, 5049), (1175532, 6099), (1181631, 5863), (1187494, 5428), (1192922, 5762), (1198684, 5191), (1203875, 5789), (1209664, 5310), (1214974, 5058), (1220032, 5058), (1225090, 5500), (1230590, 5779), (1236369, 5118), (1241487, 6385), (1247872, 5567), (1253439, 6231), (1259670, 5698), (1265368, 5367), (1270735, 5244), (1275979, 5373), (1281352, 5673), (1287025, 4989), (1292014, 5716), (1297730, 5210), (1302940, 4866), (1307806, 4807), (1312613, 6351), (1318964, 4642), (1323606, 5408), (1329014, 5124), (1334138, 5760), (1339898, 4962), (1344860, 6328), (1351188, 5670), (1356858, 5162), (1362020, 5240), (1367260, 5108), (1372368, 5290), (1377658, 5963), (1383621, 4954), (1388575, 5444), (1394019, 5543), (1399562, 4950)], [(1404512, 729), (1405241, 487), (1405728, 756), (1406484, 651), (1407135, 644), (1407779, 587), (1408366, 584), (1408950, 519), (1409469, 571), (1410040, 577), (1410617, 451), (1411068, 590), (1411658, 725), (1412383, 754), (1413137, 511), (1413648, 680), (1414328, 1060), (1415388, 691), (1416079, 537), (1416616, 565), (1417181, 759), (1417940, 480), (1418420, 413), (1418833, 685), (1419518, 656), (1420174, 656), (1420830, 575), (1421405, 1091), (1422496, 571), (1423067, 658), (1423725, 415), (1424140, 671), (1424811, 666), (1425477, 529), (1426006, 733), (1426739, 687), (1427426, 485), (1427911, 638), (1428549, 482), (1429031, 622), (1429653, 613), (1430266, 534), (1430800, 502), (1431302, 593), (1431895, 599), (1432494, 556), (1433050, 527), (1433577, 503), (1434080, 474), (1434554, 506), (1435060, 595), (1435655, 582), (1436237, 743), (1436980, 898), (1437878, 1084), (1438962, 613), (1439575, 756), (1440331, 625), (1440956, 521), (1441477, 538), (1442015, 789), (1442804, 566), (1443370, 864), (1444234, 771), (1445005, 727), (1445732, 613), (1446345, 745), (1447090, 484), (1447574, 522), (1448096, 676), (1448772, 576), (1449348, 594), (1449942, 326), (1450268, 583), (1450851, 567), (1451418, 620), (1452038, 376), (1452414, 709), (1453123, 786), (1453909, 456), (1454365, 538), (1454903, 571), (1455474, 681), (1456155, 694), (1456849, 696), (1457545, 652), (1458197, 586), (1458783, 603), (1459386, 705), (1460091, 563), (1460654, 936), (1461590, 727), (1462317, 888), (1463205, 603), (1463808, 667), (1464475, 483), (1464958, 699), (1465657, 553), (1466210, 312), (1466522, 638), (1467160, 549), (1467709, 596), (1468305, 520), (1468825, 593), (1469418, 436), (1469854, 485), (1470339, 435), (1470774, 428), (1471202, 494), (1471696, 567), (1472263, 591), (1472854, 854), (1473708, 799), (1474507, 639), (1475146, 572), (1475718, 560), (1476278, 622), (1476900, 732), (1477632, 536), (1478168, 584), (1478752, 826), (1479578, 480), (1480058, 664), (1480722, 821), (1481543, 595), (1482138, 727), (1482865, 474), (1483339, 636), (1483975, 495), (1484470, 795), (1485265, 569), (1485834, 589), (1486423, 581), (1487004, 606), (1487610, 442), (1488052, 777), (1488829, 722), (1489551, 452), (1490003, 634), (1490637, 742), (1491379, 596), (1491975, 392), (1492367, 574), (1492941, 412), (1493353, 686), (1494039, 592), (1494631, 793), (1495424, 470), (1495894, 553), (1496447, 691), (1497138, 399), (1497537, 530), (1498067, 684), (1498751, 659), (1499410, 666), (1500076, 517), (1500593, 418), (1501011, 788), (1501799, 687), (1502486, 724), (1503210, 757), (1503967, 432), (1504399, 669), (1505068, 595), (1505663, 734), (1506397, 707), (1507104, 525), (1507629, 684), (1508313, 582), (1508895, 541), (1509436, 657), (1510093, 528), (1510621, 1072), (1511693, 650), (1512343, 712), (1513055, 693), (1513748, 502), (1514250, 615), (1514865, 606), (1515471, 590), (1516061, 1685), (1517746, 466), (1518212, 619), (1518831, 595), (1519426, 806), (1520232, 586), (1520818, 472), (1521290, 512), (1521802, 492), (1522294, 818), (1523112, 426), (1523538, 440), (1523978, 467), (1524445, 938), (1525383, 470), (1525853, 549), (1526402, 703), (1527105, 634), (1527739, 683), (1528422, 646), (1529068, 510), (1529578, 797), (1530375, 599), (1530974, 632), (1531606, 588), (1532194, 653), (1532847, 799), (1533646, 812), (1534458, 509), (1534967, 661), (1535628, 818), (1536446, 581), (1537027, 685), (1537712, 945), (1538657, 489), (1539146, 646), (1539792, 633), (1540425, 441), (1540866, 412), (1541278, 387), (1541665, 462), (1542127, 641), (1542768, 585), (1543353, 553), (1543906, 450), (1544356, 487), (1544843, 529), (1545372, 642), (1546014, 697), (1546711, 501), (1547212, 707), (1547919, 541), (1548460, 738), (1549198, 564), (1549762, 658), (1550420, 573), (1550993, 778), (1551771, 561), (1552332, 696), (1553028, 695), (1553723, 581), (1554304, 515), (1554819, 636), (1555455, 410), (1555865, 660), (1556525, 413), (1556938, 504), (1557442, 750), (1558192, 501), (1558693, 616), (1559309, 1998), (1561307, 483), (1561790, 792), (1562582, 583), (1563165, 596), (1563761, 690)], [(1564451, 48), None, None, (1564499, 42), None, (1564541, 27), (1564568, 25), None, None, None, None, None, (1564593, 16), None, None, None, None, (1564609, 42), (1564651, 20), None, (1564671, 16), None, None, (1564687, 18), None, None, None, None, None, None, None, None, (1564705, 21), (1564726, 25), None, None, (1564751, 26), None, None, None, None, (1564777, 44), (1564821, 21), (1564842, 23), None, None, None, None, None, None, None, None, None, None, (1564865, 31), (1564896, 19), None, None, None, (1564915, 42), None, (1564957, 16), None, (1564973, 21), None, None, (1564994, 42), None, None, (1565036, 42), None, None, None, None, None, (1565078, 37), (1565115, 21), None, None, (1565136, 20), (1565156, 42), None, None, None, (1565198, 25), (1565223, 17), None, (1565240, 21), (1565261, 21), None, None, (1565282, 24), None, (1565306, 24), (1565330, 21), None, None, (1565351, 22), None, None, None, (1565373, 19), None, None, None, None, (1565392, 31), None, None, None, None, None, None, None, None, (1565423, 42), (1565465, 42), (1565507, 17), (1565524, 17), None, None, (1565541, 19), None, (1565560, 25), (1565585, 17), None, (1565602, 20), None, None, (1565622, 42), (1565664, 63), None, None, None, (1565727, 21), None, None, None, None, (1565748, 21), (1565769, 16), (1565785, 17), (1565802, 31), None, None, None, None, (1565833, 42), None, (1565875, 25), None, (1565900, 9), None, (1565909, 21), (1565930, 42), None, None, (1565972, 65), (1566037, 56), (1566093, 21), None, (1566114, 42), None, None, (1566156, 24), None, None, None, None, None, None, (1566180, 42), (1566222, 21), (1566243, 21), None, (1566264, 42), (1566306, 25), None, (1566331, 37), (1566368, 21), (1566389, 42), None, None, (1566431, 21), (1566452, 16), None, None, (1566468, 16), (1566484, 30), (1566514, 51), None, None, (1566565, 21), None, (1566586, 22), (1566608, 21), (1566629, 21), None, None, (1566650, 63), (1566713, 41), (1566754, 39), (1566793, 42), None, None, None, None, None, None, (1566835, 21), (1566856, 21), None, None, (1566877, 21), None, None, (1566898, 21), None, None, None, (1566919, 50), None, None, None, (1566969, 50), None, (1567019, 21), (1567040, 21), (1567061, 19), None, (1567080, 16), (1567096, 26), None, (1567122, 58), (1567180, 42), None, None, None, None, None, None, (1567222, 41), None, None, None, (1567263, 21), None, None, (1567284, 44), None, (1567328, 254), (1567582, 21), None, None, (1567603, 21), None], [None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None]]  # noqa: E501
 _CRC8_TABLE = [
     0x00, 0x07, 0x0e, 0x09, 0x1c, 0x1b, 0x12, 0x15,
     0x38, 0x3f, 0x36, 0x31, 0x24, 0x23, 0x2a, 0x2d,
@@ -49,75 +86,1681 @@ _CRC8_TABLE = [
 
 _IS_LEAF = 0x80
 _INCLUDE_SUBDOMAINS = 0x40
+_LABEL_SIZE = 0x3F
 
+# hstspreload.bin starts with a header of the magic, the format version
+# and the number of sections, followed by a (tag, offset, size) entry
+# for each section. Buckets of entries are keyed by the layer and a hash
+# of the label and are stored back to back in the 'DATA' section. The
+# bucket at position N of the 'JUMP' section spans from offset [N] to [N+1].
+#
+# Format 1 hashes labels with CRC8, the 'JUMP' section holds offsets for
+# all 5 * 256 keys so the key is the position of the bucket.
+#
+# Format 2 hashes labels with the lower 16 bits of CRC32, the 'KEYS' section
+# holds the keys of non-empty buckets in sorted order and the position of
+# a bucket is found with a binary search.
+#
+# Format 3 keys buckets like format 2 but shares the suffixes of leaves.
+# Each entry starts with a byte of the flags and the size of its label, which
+# DNS limits to 63. Leaves only hold their first label followed by a varint
+# position in the 'SUFX' section, a table of size-prefixed parent domains
+# ordered from the most to the least used.
+#
+# Format 4 has the buckets of format 3 with 16-bit keys and offsets. 'KEYS'
+# holds the label hashes of each layer in sorted order, those of layer N
+# from position [N] to [N+1] of 'LAYR'. 'JUMP' only holds the lower 16 bits
+# of each offset, the upper bits of the offset at position N are the number
+# of positions up to N in 'HIGH', where the offsets cross a multiple of 64KB.
+#
+# Any format may have a 'BLOM' section, a Bloom filter of every preloaded
+# host. It starts with the number of hashes and the number of bits followed
+# by the bits, see _in_bloom_filter(). The 'META' section holds the version
+# and the checksum of the list separated by a newline.
+_MAGIC = b"HSTS"
+_FORMAT_VERSION = 4
+_HEADER = struct.Struct("<4sHH")
+_SECTION = struct.Struct("<4sII")
+_BLOOM = struct.Struct("<II")
 
-try:
-    from importlib.resources import open_binary
+# Index files written by share_index() use the same layout with their own
+# magic. 'HASH' holds the sorted 64-bit hashes of every preloaded host,
+# the name with the hash at position N spans from offset [N] to [N+1] of
+# 'OFFS' in 'NAME' and its include_subdomains flag is byte N of 'FLAG'.
+# 'LIST' is the checksum of the list the index was built from.
+_INDEX_MAGIC = b"HSTI"
+_INDEX_VERSION = 1
+_INDEX_ENV = "HSTSPRELOAD_INDEX"
 
-    def open_pkg_binary(path: str) -> typing.BinaryIO:
-        return open_binary("hstspreload", path)
+# Delta files written by build-hstspreload.py --delta turn one data file into
+# the next one of the same format. 'FROM' is the checksum of the list and the
+# SHA-256 of the data file the delta applies to, 'HASH' the SHA-256 of the
+# result. Buckets whose key is at position N of 'KEYS' are replaced by
+# offset [N] to [N+1] of 'OFFS' in 'DATA', emptied buckets are removed and
+# the jump table is rebuilt. Every other section of the result is patched
+# from the same section of the original, 'PTCH' holds a record of the tag,
+# the size and the number of runs for each followed by (offset, size, bytes)
+# runs that differ.
+_DELTA_MAGIC = b"HSTD"
+_DELTA_VERSION = 1
+_PATCH = struct.Struct("<4sII")
+_RUN = struct.Struct("<II")
 
-except ImportError:
 
-    def open_pkg_binary(path: str) -> typing.BinaryIO:
+def open_pkg_binary(path: str) -> typing.BinaryIO:
+    # importlib.resources is imported lazily as it's slow to import.
+    try:
+        from importlib.resources import open_binary
+    except ImportError:
         return open(
             os.path.join(os.path.dirname(os.path.abspath(__file__)), path),
             "rb",
         )
+    return open_binary("hstspreload", path)
+
+
+# The data file is mapped once per process and shared by all lookups.
+_Bloom = typing.Tuple[int, int, memoryview]
+
+
+# Decoded buckets in least recently used order, keyed by bucket key.
+# A decoded bucket maps each leaf to its include_subdomains flag and holds
+# the labels to traverse. Buckets are only decoded once they've been used
+# twice, until then they're None and scanned in place.
+_Bucket = typing.Tuple[typing.Dict[bytes, bool], typing.FrozenSet[bytes]]
+_BUCKET_CACHE_SIZE = 256
+_SCAN_BUCKET_SIZE = 256
+_buckets_lock = threading.Lock()
+
+
+class _Data(typing.NamedTuple):
+    """The data file parsed into its sections, along with everything derived
+    from it so that a lookup sees one consistent dataset throughout.
+    """
+
+    version: int
+    keys: typing.Optional[typing.Sequence[int]]
+    jumptable: typing.Sequence[int]
+    # The 'LAYR' and 'HIGH' sections of format 4, see _read_bucket().
+    layers: typing.Optional[typing.Sequence[int]]
+    high: typing.Optional[typing.Sequence[int]]
+    buckets: memoryview
+    bloom: typing.Optional[_Bloom]
+    suffixes: typing.Optional[typing.Sequence[bytes]]
+    meta: typing.Optional[typing.Tuple[str, str]]
+    gtlds: typing.AbstractSet[bytes]
+    decoded: "collections.OrderedDict[int, typing.Optional[_Bucket]]"
+    # The file was read into memory rather than mapped, see _start_read().
+    resident: bool
+
+
+class DatasetInfo(typing.NamedTuple):
+    """The list lookups are using, see dataset_info()"""
+
+    version: typing.Optional[str]
+    checksum: typing.Optional[str]
+    # None for the data file installed with the package.
+    path: typing.Optional[str]
+
+
+_data_lock = threading.Lock()
+_data: typing.Optional[_Data] = None
+_data_source: typing.Optional[typing.Union[mmap.mmap, bytes]] = None
+_data_path: typing.Optional[str] = None
+_dataset = DatasetInfo(__version__, __checksum__, None)
+
+
+class LookupResult(typing.NamedTuple):
+    """The result of lookup() along with the entry of the list that matched.
+    It's true if the host is preloaded, false otherwise.
+    """
+
+    preloaded: bool
+    # The preloaded host or parent domain, None if the host isn't preloaded.
+    name: typing.Optional[bytes]
+    # The host is a subdomain of 'name', which includes its subdomains,
+    # so every other subdomain of 'name' gets the same result.
+    include_subdomains: bool
+    # 'name' is a gTLD that includes its subdomains, these are answered
+    # without reading any buckets of the data file.
+    fast_path: bool
+
+    def __bool__(self) -> bool:
+        return self.preloaded
+
+
+_NOT_PRELOADED = LookupResult(False, None, False, False)
+
+# Looks up normalized hosts instead of the data file,
+# see load_index() and share_index().
+_index: typing.Optional[typing.Callable[[bytes], LookupResult]] = None
+
+
+class CacheInfo(typing.NamedTuple):
+    """Statistics of the in_hsts_preload() cache, see cache_info()"""
+
+    hits: int
+    misses: int
+    maxsize: typing.Optional[int]
+    currsize: int
+    evictions: int
+
+
+# Results of in_hsts_preload() in least recently used order, keyed by the
+# normalized host so that different spellings of a host share one entry.
+# Results of subdomains of an include_subdomains entry are keyed by the
+# entry's name with a leading dot instead, one entry covers all of them.
+_cache: "collections.OrderedDict[bytes, LookupResult]" = collections.OrderedDict()
+_cache_maxsize: typing.Optional[int] = 1024
+_cache_hits = 0
+_cache_misses = 0
+_cache_evictions = 0
+_cache_lock = threading.Lock()
+# Bumped whenever cached results become stale, results of lookups that
+# started before then aren't cached.
+_cache_generation = 0
+
+# Called with the LookupStats of every in_hsts_preload() call, see set_lookup_hook()
+_lookup_hook: typing.Optional[typing.Callable[["LookupStats"], None]] = None
+
+# ain_hsts_preload() only looks hosts up on the event loop once the data file
+# has been read into memory by a thread, pages of a mapped file could be
+# evicted and read from disk again at any time. Lookups that need it in the
+# meantime all wait for the same read.
+_ASYNC_BATCH_SIZE = 1000
+_async_lock = threading.Lock()
+_executor: typing.Optional["concurrent.futures.ThreadPoolExecutor"] = None
+_reading: typing.Optional["concurrent.futures.Future[None]"] = None
+
+
+def _get_data() -> _Data:
+    data = _data
+    if data is None:
+        data = _open_data()
+    return data
+
+
+def _open_data() -> _Data:
+    global _data, _data_source, _dataset
+    with _data_lock:
+        if _data is None:
+            source = _read_source(_data_path)
+            _data = _parse_data(source, packaged=_data_path is None)
+            _data_source = source
+            _dataset = _dataset_info(_data, _data_path)
+        return _data
+
+
+def _read_source(
+    path: typing.Optional[str], in_memory: bool = False
+) -> typing.Union[mmap.mmap, bytes]:
+    """Maps a data file, the packaged one if 'path' is None, or reads it into
+    memory if 'in_memory' is true
+    """
+    with open_pkg_binary("hstspreload.bin") if path is None else open(path, "rb") as f:
+        if not in_memory:
+            try:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # Zipped installs don't have a file we can map,
+                # so read the whole file into memory instead.
+                pass
+        return f.read()
+
+
+def _parse_data(
+    source: typing.Union[mmap.mmap, bytes], packaged: bool = False
+) -> _Data:
+    magic, version, sections = _parse_sections(source)
+    if magic != _MAGIC:
+        raise ValueError("hstspreload.bin is corrupted or not a data file")
+    if version not in (1, 2, 3, 4):
+        raise ValueError("hstspreload.bin has unsupported format %d" % version)
+
+    keys = sections.get(b"KEYS")
+    if version > 1 and keys is None:
+        raise ValueError("hstspreload.bin is missing the 'KEYS' section")
+    layers = sections.get(b"LAYR")
+    high = sections.get(b"HIGH")
+    if version > 3 and (layers is None or high is None):
+        raise ValueError("hstspreload.bin is missing the 'LAYR' or 'HIGH' section")
+    suffixes = sections.get(b"SUFX")
+    if version > 2 and suffixes is None:
+        raise ValueError("hstspreload.bin is missing the 'SUFX' section")
+
+    bloom = sections.get(b"BLOM")
+    if bloom is not None:
+        hashes, bits = _BLOOM.unpack_from(bloom)
+        bloom = (hashes, bits, bloom[_BLOOM.size :])
+
+    meta = sections.get(b"META")
+    if meta is not None:
+        version_string, checksum = bytes(meta).decode("ascii").split("\n")
+        meta = (version_string, checksum)
+
+    # Format 4 has 16-bit keys and offsets.
+    cast = _cast_uint16 if version > 3 else _cast_uint32
+    data = _Data(
+        version,
+        None if keys is None else cast(keys),
+        cast(sections[b"JUMP"]),
+        # Both only have a few entries, tuples are quicker to search.
+        None if layers is None else tuple(_cast_uint32(layers)),
+        None if high is None else tuple(_cast_uint32(high)),
+        sections[b"DATA"],
+        bloom,
+        None if suffixes is None else _parse_suffixes(suffixes),
+        meta,
+        frozenset(),
+        collections.OrderedDict(),
+        not isinstance(source, mmap.mmap),
+    )
+    if packaged and (meta is None or meta[1] == __checksum__):
+        # This module was generated along with the packaged data file,
+        # unless that has been patched with apply_delta() since.
+        return data._replace(gtlds=_GTLD_INCLUDE_SUBDOMAINS)
+    return data._replace(gtlds=_find_gtlds(data))
+
+
+def _dataset_info(data: _Data, path: typing.Optional[str]) -> DatasetInfo:
+    if data.meta is not None:
+        return DatasetInfo(data.meta[0], data.meta[1], path)
+    if path is None:
+        return DatasetInfo(__version__, __checksum__, None)
+    return DatasetInfo(None, None, path)
+
+
+def _find_gtlds(data: _Data) -> typing.FrozenSet[bytes]:
+    """Returns the gTLDs which include all their subdomains, the leaves with
+    include_subdomains in the buckets of the first layer.
+    """
+    first_layer = 256 if data.version == 1 else 1 << 16
+    gtlds = set()
+    for key, entries in _iter_buckets(data):
+        if key >= first_layer:
+            break
+        for flags, name, _ in _iter_names(entries, data.suffixes):
+            if flags & _IS_LEAF and flags & _INCLUDE_SUBDOMAINS:
+                gtlds.add(name)
+    return frozenset(gtlds)
+
+
+def _parse_suffixes(view: memoryview) -> typing.Tuple[bytes, ...]:
+    suffixes = []
+    offset = 0
+    while offset < len(view):
+        end = offset + 1 + view[offset]
+        suffixes.append(bytes(view[offset + 1 : end]))
+        offset = end
+    return tuple(suffixes)
+
+
+def _parse_sections(
+    source: typing.Union[mmap.mmap, bytes],
+) -> typing.Tuple[
+    typing.Optional[bytes], typing.Optional[int], typing.Dict[bytes, memoryview]
+]:
+    """Returns the magic, the format version and the sections of a file"""
+    view = memoryview(source)
+    try:
+        magic, version, count = _HEADER.unpack_from(view)
+        sections = {}
+        for i in range(count):
+            tag, offset, size = _SECTION.unpack_from(
+                view, _HEADER.size + i * _SECTION.size
+            )
+            sections[tag] = view[offset : offset + size]
+    except struct.error:
+        return None, None, {}
+    return magic, version, sections
+
+
+def _encode_sections(
+    magic: bytes, version: int, sections: typing.List[typing.Tuple[bytes, bytes]]
+) -> bytes:
+    """Encodes the header, the section entries and the sections of a file"""
+    chunks = [_HEADER.pack(magic, version, len(sections))]
+    offset = _HEADER.size + _SECTION.size * len(sections)
+    for tag, section in sections:
+        chunks.append(_SECTION.pack(tag, offset, len(section)))
+        offset += len(section)
+    for _, section in sections:
+        chunks.append(section)
+    return b"".join(chunks)
+
+
+def _cast_uint32(view: memoryview) -> typing.Sequence[int]:
+    # Integers are little-endian, only copy them when that's not native.
+    if sys.byteorder == "little":
+        return view.cast("I")
+    return struct.unpack("<%dI" % (len(view) // 4), view)
+
+
+def _cast_uint16(view: memoryview) -> typing.Sequence[int]:
+    if sys.byteorder == "little":
+        return view.cast("H")
+    return struct.unpack("<%dH" % (len(view) // 2), view)
+
+
+def _cast_uint64(view: memoryview) -> typing.Sequence[int]:
+    if sys.byteorder == "little":
+        return view.cast("Q")
+    return struct.unpack("<%dQ" % (len(view) // 8), view)
+
+
+def close() -> None:
+    """Releases the data file, the next lookup will open it again"""
+    global _data, _data_source
+    with _data_lock:
+        data, source = _data, _data_source
+        _data = _data_source = None
+    # The next lookup may read a different data file.
+    _invalidate_cache()
+
+    # Drop our views into the map before trying to unmap it.
+    del data
+    _unmap(source)
+
+
+def reopen() -> None:
+    """Closes and re-opens the data file, e.g. after it's been replaced on disk"""
+    close()
+    _get_data()
+
+
+def load_dataset(path: typing.Optional[str]) -> DatasetInfo:
+    """Swaps in the data file at 'path' built by build-hstspreload.py, or the
+    packaged data file if 'path' is None. Returns the version and checksum
+    of its list.
+
+    The new file is mapped and parsed before the swap, lookups in progress
+    finish on the data they started with and the old file is released once
+    they're done. Cached results are invalidated. An index from load_index()
+    is rebuilt for the new list, a shared index is dropped and has to be
+    shared again with share_index().
+    """
+    global _data, _data_source, _data_path, _dataset, _index
+    source = _read_source(path)
+    data = _parse_data(source, packaged=path is None)
+    dataset = _dataset_info(data, path)
+
+    index = _index
+    if isinstance(index, functools.partial) and index.func is _in_index:
+        index = functools.partial(_in_index, _build_index(data))
+    else:
+        _unshare_index(index)
+        index = None
+
+    with _data_lock:
+        old, old_source = _data, _data_source
+        _data, _data_source, _data_path = data, source, path
+        _dataset, _index = dataset, index
+    _invalidate_cache()
+
+    del old
+    _unmap(old_source)
+    return dataset
+
+
+def dataset_info() -> DatasetInfo:
+    """Returns the version, checksum and path of the list lookups are using"""
+    if _index is None:
+        _get_data()
+    return _dataset
+
+
+def apply_delta(
+    delta: str, path: typing.Optional[str] = None, output: typing.Optional[str] = None
+) -> DatasetInfo:
+    """Patches the data file at 'path', the packaged one if None, with a delta
+    file from build-hstspreload.py --delta. The result replaces 'path' or
+    is written to 'output'. Returns the version and checksum of its list,
+    call load_dataset() or reopen() to switch lookups to it.
+
+    The result is verified against the delta before it's written and only
+    renamed into place once complete. ValueError is raised if the delta is
+    for another data file or doesn't verify, no file is changed then.
+    """
+    packaged = path is None and output is None
+    if path is None:
+        path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "hstspreload.bin"
+        )
+    with open(delta, "rb") as f:
+        patch = f.read()
+    with open(path, "rb") as f:
+        content = _apply_delta(f.read(), patch)
+    version, checksum = _parse_data(content).meta or (None, None)
+
+    output = output or path
+    # Lookups mapping the file keep reading the original until they reopen it.
+    try:
+        with open(output + ".tmp", "wb") as f:
+            f.write(content)
+        os.replace(output + ".tmp", output)
+    except BaseException:
+        if os.path.exists(output + ".tmp"):
+            os.unlink(output + ".tmp")
+        raise
+    return DatasetInfo(version, checksum, None if packaged else output)
+
+
+def _apply_delta(base: bytes, delta: bytes) -> bytes:
+    import hashlib
+
+    magic, version, sections = _parse_sections(delta)
+    if magic != _DELTA_MAGIC:
+        raise ValueError("not a hstspreload delta file")
+    if version != _DELTA_VERSION:
+        raise ValueError("delta file has unsupported format %d" % version)
+    try:
+        checksum, base_hash = bytes(sections[b"FROM"]).decode("ascii").split("\n")
+        target_hash = bytes(sections[b"HASH"]).decode("ascii")
+    except (KeyError, ValueError):
+        raise ValueError("delta file is corrupted") from None
+
+    data = _parse_data(base)
+    if data.meta is None or data.meta[1] != checksum:
+        raise ValueError("delta file is for list %s" % checksum)
+    if hashlib.sha256(base).hexdigest() != base_hash:
+        raise ValueError("delta file is for another data file of list %s" % checksum)
+
+    _, _, base_sections = _parse_sections(base)
+    try:
+        keys = _cast_uint32(sections[b"KEYS"])
+        offsets = _cast_uint32(sections[b"OFFS"])
+        buckets = sections[b"DATA"]
+        patches = sections[b"PTCH"]
+
+        patched = dict(_iter_buckets(data))
+        for position, key in enumerate(keys):
+            patched[key] = bytes(buckets[offsets[position] : offsets[position + 1]])
+        sections = _encode_bucket_sections(data.version, patched)
+
+        offset = 0
+        while offset < len(patches):
+            tag, size, runs = _PATCH.unpack_from(patches, offset)
+            offset += _PATCH.size
+            section = bytearray(size)
+            original = base_sections.get(tag, b"")[:size]
+            section[: len(original)] = original
+            for _ in range(runs):
+                start, length = _RUN.unpack_from(patches, offset)
+                offset += _RUN.size
+                section[start : start + length] = patches[offset : offset + length]
+                offset += length
+            sections.append((tag, bytes(section)))
+    except (KeyError, IndexError, TypeError, struct.error):
+        raise ValueError("delta file is corrupted") from None
+
+    content = _encode_sections(_MAGIC, data.version, sections)
+    if hashlib.sha256(content).hexdigest() != target_hash:
+        raise ValueError("patched data file doesn't match the delta's checksum")
+    return content
+
+
+def _iter_buckets(data: _Data) -> typing.Iterator[typing.Tuple[int, memoryview]]:
+    """Yields the key and the entries of every non-empty bucket in key order"""
+    offsets = _iter_offsets(data)
+    start = next(offsets)
+    for key, end in zip(_iter_keys(data), offsets):
+        if start != end:
+            yield key, data.buckets[start:end]
+        start = end
+
+
+def _iter_keys(data: _Data) -> typing.Iterator[int]:
+    keys = data.keys
+    layers = data.layers
+    if keys is None:
+        return iter(range(len(data.jumptable) - 1))
+    if layers is None:
+        return iter(keys)
+    return (
+        layer << 16 | keys[position]
+        for layer in range(len(layers) - 1)
+        for position in range(layers[layer], layers[layer + 1])
+    )
+
+
+def _iter_offsets(data: _Data) -> typing.Iterator[int]:
+    """Yields the offset of every position of the jump table"""
+    high = data.high
+    if high is None:
+        yield from data.jumptable
+        return
+    upper = 0
+    wraps = 0
+    for position, lower in enumerate(data.jumptable):
+        while wraps < len(high) and high[wraps] <= position:
+            upper += 1 << 16
+            wraps += 1
+        yield upper | lower
+
+
+def _encode_bucket_sections(
+    version: int, buckets: typing.Mapping[int, bytes]
+) -> typing.List[typing.Tuple[bytes, bytes]]:
+    """Encodes the 'KEYS', 'JUMP' and 'DATA' sections of the buckets by key,
+    and the 'LAYR' and 'HIGH' sections in format 4. Empty buckets are left out.
+    """
+    if version == 1:
+        # Every possible key has an offset in the jump table.
+        keys = list(range(5 * 256))
+    else:
+        keys = sorted(key for key, entries in buckets.items() if entries)
+
+    jump_table = [0]
+    for key in keys:
+        jump_table.append(jump_table[-1] + len(buckets.get(key, b"")))
+
+    sections = []
+    if version > 3:
+        # Where the keys of each layer start, followed by the end of the last.
+        count = (keys[-1] >> 16) + 1 if keys else 0
+        layers = [bisect_left(keys, layer << 16) for layer in range(count)]
+        layers.append(len(keys))
+        high = []
+        for position in range(1, len(jump_table)):
+            wraps = (jump_table[position] >> 16) - (jump_table[position - 1] >> 16)
+            high.extend([position] * wraps)
+        hashes = [key & 0xFFFF for key in keys]
+        lower = [offset & 0xFFFF for offset in jump_table]
+        sections.append((b"KEYS", struct.pack("<%dH" % len(hashes), *hashes)))
+        sections.append((b"LAYR", struct.pack("<%dI" % len(layers), *layers)))
+        sections.append((b"JUMP", struct.pack("<%dH" % len(lower), *lower)))
+        sections.append((b"HIGH", struct.pack("<%dI" % len(high), *high)))
+    else:
+        if version > 1:
+            sections.append((b"KEYS", struct.pack("<%dI" % len(keys), *keys)))
+        sections.append((b"JUMP", struct.pack("<%dI" % len(jump_table), *jump_table)))
+    sections.append((b"DATA", b"".join(buckets.get(key, b"") for key in keys)))
+    return sections
+
+
+def _unmap(source: typing.Optional[typing.Union[mmap.mmap, bytes]]) -> None:
+    if isinstance(source, mmap.mmap):
+        try:
+            source.close()
+        except BufferError:
+            # Lookups in other threads still hold views into the map,
+            # it is unmapped once the last of those views is released.
+            pass
+
+
+def _reset_after_fork() -> None:
+    # The lock may have been held by another thread while forking.
+    # The mapping itself is read-only and stays valid in the child.
+    global _data_lock, _buckets_lock, _cache_lock, _async_lock, _executor, _reading
+    _data_lock = threading.Lock()
+    _buckets_lock = threading.Lock()
+    _cache_lock = threading.Lock()
+    # The thread reading the data file doesn't survive the fork.
+    _async_lock = threading.Lock()
+    _executor = None
+    _reading = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
 
-@functools.lru_cache(maxsize=1024)
 def in_hsts_preload(host: typing.AnyStr) -> bool:
     """Determines if an IDNA-encoded host is on the HSTS preload list"""
+    return lookup(host).preloaded
 
-    if isinstance(host, str):
-        host = host.encode("ascii")
-    labels = host.lower().split(b".")
+
+def lookup(host: typing.AnyStr) -> LookupResult:
+    """Same as in_hsts_preload() but also returns the entry of the list that
+    matched the IDNA-encoded host, see LookupResult. If several do the one
+    closest to the TLD is returned.
+    """
+
+    host = _normalize_host(host)
+    hook = _lookup_hook
+    if hook is not None:
+        return _traced_lookup(host, hook)
+
+    result = _cache_get(host)
+    if result is None:
+        generation = _cache_generation
+        result = _lookup(host)
+        _cache_put(host, result, generation)
+    return result
+
+
+def _traced_lookup(
+    host: bytes, hook: typing.Callable[["LookupStats"], None]
+) -> LookupResult:
+    stats = LookupStats(host)
+    started = time.perf_counter_ns()
+    result = _cache_get(host)
+    if result is None:
+        generation = _cache_generation
+        result = _lookup(host, stats)
+        _cache_put(host, result, generation)
+    else:
+        stats.cache_hit = True
+    stats.duration_ns += time.perf_counter_ns() - started
+    stats.result = result.preloaded
+    hook(stats)
+    return result
+
+
+def _lookup(host: bytes, stats: typing.Optional["LookupStats"] = None) -> LookupResult:
+    index = _index
+    if index is not None:
+        return index(host)
+
+    data = _get_data()
+    labels = host.split(b".")
 
     # Fast-branch for gTLDs that are registered to preload all sub-domains.
-    if labels[-1] in _GTLD_INCLUDE_SUBDOMAINS:
-        return True
+    if labels[-1] in data.gtlds:
+        if stats is not None:
+            stats.fast_path = True
+        return LookupResult(True, labels[-1], len(labels) > 1, True)
+
+    # Most hosts aren't preloaded, rule them out before reading any buckets.
+    if data.bloom is not None and not _in_bloom_filter(data.bloom, host):
+        if stats is not None:
+            stats.bloom_rejected = True
+        return _NOT_PRELOADED
+
+    start = len(host) + 1
+    for layer, label in enumerate(labels[::-1]):
+        # None of our layers are greater than 5 deep.
+        if layer > 4:
+            return _NOT_PRELOADED
+
+        # Read the jump table for the layer and label
+        key = _bucket_key(data.version, layer, label)
+        entries = _read_bucket(data, key)
+        if stats is not None:
+            stats.layers += 1
+        if entries is None:
+            # No entry: host is not preloaded
+            return _NOT_PRELOADED
+
+        # Match against the set of entries for that layer and label
+        start -= len(label) + 1
+        suffix = host[start:]
+        bucket = _get_bucket(data, key, entries)
+        if bucket is not None:
+            found = _match_bucket(bucket, host, suffix, label)
+        elif data.suffixes is None:
+            found = _match_entries(entries, host, suffix, label)
+        else:
+            found = _match_compact_entries(entries, data.suffixes, host, suffix, label)
+        if stats is not None:
+            _trace_bucket(
+                stats, key, entries, data.suffixes, bucket, found, suffix, label
+            )
+        if found:
+            # The leaf is the suffix, a shorter one than the host includes
+            # its subdomains.
+            return LookupResult(True, suffix, start > 0, False)
+        if found is not None:
+            return _NOT_PRELOADED
+    return _NOT_PRELOADED
+
+
+def in_hsts_preload_many(hosts: typing.Iterable[typing.AnyStr]) -> typing.List[bool]:
+    """Determines which of the IDNA-encoded hosts are on the HSTS preload list.
+    Each bucket of entries is only read and decoded once for the whole batch.
+    """
+
+    index = _index
+    if index is not None:
+        return [index(_normalize_host(host)).preloaded for host in hosts]
+
+    # Hosts still being traversed are grouped by their label at the current
+    # layer and tracked by index with the offset where their suffix starts,
+    # which keeps the number of objects the garbage collector sees down.
+    data = _get_data()
+    normalized = []
+    starts = []
+    results = []
+    pending: typing.Dict[bytes, typing.List[int]] = {}
+    for index, host in enumerate(hosts):
+        host = _normalize_host(host)
+        start = host.rfind(b".") + 1
+        label = host[start:]
+        normalized.append(host)
+        starts.append(start)
+        if label in data.gtlds:
+            results.append(True)
+        else:
+            results.append(False)
+            if data.bloom is None or _in_bloom_filter(data.bloom, host):
+                pending.setdefault(label, []).append(index)
+
+    for layer in range(5):
+        if not pending:
+            break
+
+        buckets: typing.Dict[int, list] = {}
+        for label, indexes in pending.items():
+            key = _bucket_key(data.version, layer, label)
+            buckets.setdefault(key, []).append((label, indexes))
+
+        pending = {}
+        for key, groups in buckets.items():
+            entries = _read_bucket(data, key)
+            if entries is None:
+                continue
+
+            # Decode the bucket once if more than one host needs it.
+            bucket = _get_bucket(
+                data, key, entries, decode=len(groups) > 1 or len(groups[0][1]) > 1
+            )
+            for label, indexes in groups:
+                for index in indexes:
+                    host = normalized[index]
+                    start = starts[index]
+                    suffix = host[start:]
+                    if bucket is not None:
+                        found = _match_bucket(bucket, host, suffix, label)
+                    elif data.suffixes is None:
+                        found = _match_entries(entries, host, suffix, label)
+                    else:
+                        found = _match_compact_entries(
+                            entries, data.suffixes, host, suffix, label
+                        )
+
+                    if found is not None:
+                        results[index] = found
+                    elif start > 0:
+                        dot = host.rfind(b".", 0, start - 1)
+                        pending.setdefault(host[dot + 1 : start - 1], []).append(index)
+                        starts[index] = dot + 1
+    return results
+
+
+async def ain_hsts_preload(host: typing.AnyStr) -> bool:
+    """Same as in_hsts_preload() for asyncio. Cached results are returned right
+    away. The first lookup that needs the data file reads it into memory in a
+    thread instead of mapping it, so the event loop doesn't block on disk I/O.
+    Lookups in the meantime wait for the same read.
+    """
+    host = _normalize_host(host)
+    hook = _lookup_hook
+    if hook is not None:
+        await _load()
+        return _traced_lookup(host, hook).preloaded
+
+    result = _cache_get(host)
+    if result is None:
+        generation = _cache_generation
+        await _load()
+        result = _lookup(host)
+        _cache_put(host, result, generation)
+    return result.preloaded
+
+
+async def ain_hsts_preload_many(
+    hosts: typing.Iterable[typing.AnyStr],
+) -> typing.List[bool]:
+    """Same as in_hsts_preload_many() for asyncio, see ain_hsts_preload().
+    Large batches are looked up in chunks, other tasks run in between.
+    """
+    import asyncio
+
+    normalized = [_normalize_host(host) for host in hosts]
+    results: typing.List[bool] = []
+    for start in range(0, len(normalized), _ASYNC_BATCH_SIZE):
+        if start:
+            await asyncio.sleep(0)
+        await _load()
+        results.extend(
+            in_hsts_preload_many(normalized[start : start + _ASYNC_BATCH_SIZE])
+        )
+    return results
+
+
+async def _load() -> None:
+    """Waits until lookups don't need to read from disk"""
+    import asyncio
+
+    read = _start_read()
+    while read is not None:
+        # Other lookups may be waiting for the same read, don't cancel it.
+        await asyncio.shield(asyncio.wrap_future(read))
+        read = _start_read()
 
-    with open_pkg_binary("hstspreload.bin") as f:
-        for layer, label in enumerate(labels[::-1]):
-            # None of our layers are greater than 5 deep.
-            if layer > 4:
-                return False
-
-            # Read the jump table for the layer and label
-            jump_info = _JUMPTABLE[layer][_crc8(label)]
-            if jump_info is None:
-                # No entry: host is not preloaded
-                return False
-
-            # Read the set of entries for that layer and label
-            f.seek(jump_info[0])
-            data = bytearray(jump_info[1])
-            f.readinto(data)
-
-            for is_leaf, include_subdomains, ent_label in _iter_entries(data):
-                # We found a potential leaf
-                if is_leaf:
-                    if ent_label == host:
-                        return True
-                    if include_subdomains and host.endswith(b"." + ent_label):
-                        return True
-
-                # Continue traversing as we're not at a leaf.
-                elif label == ent_label:
+
+def _start_read() -> typing.Optional["concurrent.futures.Future[None]"]:
+    """Returns the read of the data file or the shared index in progress,
+    starting one if needed, or None if lookups are done from memory
+    """
+    global _executor, _reading
+    index = _index
+    if index is not None and index is not _attach_from_environ:
+        # The in-memory index, or the shared one in /dev/shm by default.
+        return None
+    data = _data
+    if index is None and data is not None and data.resident:
+        return None
+
+    with _async_lock:
+        if _reading is None:
+            if _executor is None:
+                import concurrent.futures
+
+                # Only one read is in progress at a time.
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="hstspreload"
+                )
+            _reading = _executor.submit(_read_data)
+        return _reading
+
+
+def _read_data() -> None:
+    global _data, _data_source, _dataset, _reading
+    try:
+        _attach_environ_index()
+        data = _data
+        if _index is None and (data is None or not data.resident):
+            path = _data_path
+            source = _read_source(path, in_memory=True)
+            resident = _parse_data(source, packaged=path is None)
+            with _data_lock:
+                # Swapped in like load_dataset() does, unless another file
+                # has been loaded meanwhile.
+                swap = _data is data and _data_path == path
+                if swap:
+                    old_source = _data_source
+                    _data, _data_source = resident, source
+                    _dataset = _dataset_info(resident, path)
+            if swap:
+                if data is not None and data.meta != resident.meta:
+                    # The file has been replaced on disk since it was mapped.
+                    _invalidate_cache()
+                del data
+                _unmap(old_source)
+    finally:
+        with _async_lock:
+            _reading = None
+
+
+def should_upgrade(url: str) -> bool:
+    """Determines if 'url' is an http:// URL whose host is on the HSTS preload list"""
+    parts = _split_http_url(url)
+    if parts is None:
+        return False
+    host = _encode_host(parts[0])
+    return host is not None and in_hsts_preload(host)
+
+
+def upgrade_url(url: str) -> str:
+    """Rewrites an http:// URL of a preloaded host to https://. An explicit
+    port 80 is dropped, other ports are kept. Other URLs are returned as is.
+    """
+    parts = _split_http_url(url)
+    if parts is not None:
+        host = _encode_host(parts[0])
+        if host is not None and in_hsts_preload(host):
+            return _upgrade_url(url, parts)
+    return url
+
+
+def upgrade_urls(urls: typing.Iterable[str]) -> typing.List[str]:
+    """Same as upgrade_url() for many URLs, looking up their hosts in one batch"""
+    urls = list(urls)
+    split = {}
+    hosts = []
+    for index, url in enumerate(urls):
+        parts = _split_http_url(url)
+        if parts is not None:
+            encoded = _encode_host(parts[0])
+            if encoded is not None:
+                split[index] = parts
+                hosts.append(encoded)
+
+    for (index, parts), found in zip(split.items(), in_hsts_preload_many(hosts)):
+        if found:
+            urls[index] = _upgrade_url(urls[index], parts)
+    return urls
+
+
+def _split_http_url(url: str) -> typing.Optional[typing.Tuple[str, int, int]]:
+    """Returns the host of an http:// URL along with the offsets of its port
+    and the end of its authority, None for other URLs and IP literals.
+    """
+    if url[:7].lower() != "http://":
+        return None
+    end = len(url)
+    for delimiter in "/?#":
+        offset = url.find(delimiter, 7, end)
+        if offset != -1:
+            end = offset
+    start = url.rfind("@", 7, end) + 1 or 7
+    if url.startswith("[", start):
+        return None
+    port = url.find(":", start, end)
+    if port == -1:
+        port = end
+    elif not url[port + 1 : end].isdigit() and port + 1 != end:
+        return None
+    return url[start:port], port, end
+
+
+def _upgrade_url(url: str, parts: typing.Tuple[str, int, int]) -> str:
+    _, port, end = parts
+    if url[port:end] in (":", ":80"):
+        return "https://" + url[7:port] + url[end:]
+    return "https://" + url[7:]
+
+
+def _encode_host(host: str) -> typing.Optional[bytes]:
+    """IDNA-encodes the host of a URL, None if it isn't a valid host name"""
+    host = host.rstrip(".")
+    if not host:
+        return None
+    try:
+        if host.isascii():
+            return host.lower().encode("ascii")
+        return host.encode("idna")
+    except UnicodeError:
+        return None
+
+
+def cache_info() -> CacheInfo:
+    """Returns the hits, misses and evictions of the in_hsts_preload() cache"""
+    with _cache_lock:
+        return CacheInfo(
+            _cache_hits, _cache_misses, _cache_maxsize, len(_cache), _cache_evictions
+        )
+
+
+def cache_clear() -> None:
+    """Empties the in_hsts_preload() cache and resets its statistics"""
+    global _cache_hits, _cache_misses, _cache_evictions
+    _invalidate_cache()
+    with _cache_lock:
+        _cache_hits = _cache_misses = _cache_evictions = 0
+
+
+def set_cache_size(maxsize: typing.Optional[int]) -> None:
+    """Sets how many results in_hsts_preload() caches, 0 disables the cache
+    and None lets it grow without bound. Entries beyond the new size are evicted.
+    """
+    global _cache_maxsize
+    if maxsize is not None and (not isinstance(maxsize, int) or maxsize < 0):
+        raise ValueError("maxsize must be a non-negative integer or None")
+    with _cache_lock:
+        _cache_maxsize = maxsize
+        _evict_cache()
+
+
+def _lru_cache_info() -> "functools._CacheInfo":
+    hits, misses, maxsize, currsize, _ = cache_info()
+    return functools._CacheInfo(hits, misses, maxsize, currsize)
+
+
+# Kept for code written against the functools.lru_cache() wrapper, which
+# reports the statistics without evictions.
+in_hsts_preload.cache_info = _lru_cache_info  # type: ignore[attr-defined]
+in_hsts_preload.cache_clear = cache_clear  # type: ignore[attr-defined]
+
+
+def _cache_get(host: bytes) -> typing.Optional[LookupResult]:
+    global _cache_hits, _cache_misses
+    with _cache_lock:
+        key = host
+        result = _cache.get(key)
+        if result is None:
+            # The result of an include_subdomains entry covering the host,
+            # there's at most one so start with the TLD.
+            dot = host.rfind(b".")
+            while dot != -1:
+                key = host[dot:]
+                result = _cache.get(key)
+                if result is not None and result.include_subdomains:
                     break
+                result = None
+                dot = host.rfind(b".", 0, dot)
+        if result is None:
+            _cache_misses += 1
+        else:
+            _cache_hits += 1
+            _cache.move_to_end(key)
+    return result
+
+
+def _cache_put(host: bytes, result: LookupResult, generation: int) -> None:
+    with _cache_lock:
+        if _cache_maxsize != 0 and generation == _cache_generation:
+            if result.include_subdomains:
+                _cache[b"." + result.name] = result  # type: ignore[operator]
             else:
-                return False
+                _cache[host] = result
+            _evict_cache()
+
+
+def _invalidate_cache() -> None:
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        _cache.clear()
+
+
+def _evict_cache() -> None:
+    # Must be called with _cache_lock held.
+    global _cache_evictions
+    if _cache_maxsize is None:
+        return
+    while len(_cache) > _cache_maxsize:
+        _cache.popitem(last=False)
+        _cache_evictions += 1
+
+
+class LookupStats:
+    """Counters of a single in_hsts_preload() or lookup() call,
+    see set_lookup_hook()
+    """
+
+    __slots__ = (
+        "host",
+        "result",
+        "cache_hit",
+        "fast_path",
+        "bloom_rejected",
+        "layers",
+        "bytes_read",
+        "entries_compared",
+        "buckets",
+        "duration_ns",
+    )
+
+    def __init__(self, host: bytes) -> None:
+        self.host = host
+        self.result = False
+        self.cache_hit = False
+        # Resolved by the gTLD fast path or rejected by the Bloom filter.
+        self.fast_path = False
+        self.bloom_rejected = False
+        # Jump table probes, bucket bytes scanned in place and entries compared
+        # (a probe of a decoded bucket counts as one entry).
+        self.layers = 0
+        self.bytes_read = 0
+        self.entries_compared = 0
+        # Keys of the buckets that were matched against.
+        self.buckets: typing.List[int] = []
+        self.duration_ns = 0
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"LookupStats({fields})"
+
+
+class LookupHistograms:
+    """Lookup hook that aggregates LookupStats into histograms. Bytes read,
+    entries compared and durations are binned by powers of two, each bin is
+    keyed by its lower bound. 'buckets' counts how often each bucket was used.
+    """
+
+    def __init__(self) -> None:
+        self.lookups = 0
+        self.cache_hits = 0
+        self.fast_path = 0
+        self.bloom_rejected = 0
+        self.layers: typing.Counter[int] = collections.Counter()
+        self.bytes_read: typing.Counter[int] = collections.Counter()
+        self.entries_compared: typing.Counter[int] = collections.Counter()
+        self.duration_ns: typing.Counter[int] = collections.Counter()
+        self.buckets: typing.Counter[int] = collections.Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, stats: LookupStats) -> None:
+        with self._lock:
+            self.lookups += 1
+            self.cache_hits += stats.cache_hit
+            self.fast_path += stats.fast_path
+            self.bloom_rejected += stats.bloom_rejected
+            self.layers[stats.layers] += 1
+            self.bytes_read[_bin(stats.bytes_read)] += 1
+            self.entries_compared[_bin(stats.entries_compared)] += 1
+            self.duration_ns[_bin(stats.duration_ns)] += 1
+            self.buckets.update(stats.buckets)
+
+
+def set_lookup_hook(
+    hook: typing.Optional[typing.Callable[[LookupStats], None]],
+) -> None:
+    """Calls 'hook' with the LookupStats of every in_hsts_preload(),
+    ain_hsts_preload() or lookup() call, e.g. a LookupHistograms instance.
+    Pass None to turn instrumentation off. Hosts looked up in batches by
+    in_hsts_preload_many() or ain_hsts_preload_many() aren't reported.
+    """
+    global _lookup_hook
+    _lookup_hook = hook
+
+
+def _bin(value: int) -> int:
+    return 1 << (value.bit_length() - 1) if value > 0 else 0
+
+
+def _trace_bucket(
+    stats: LookupStats,
+    key: int,
+    entries: memoryview,
+    suffixes: typing.Optional[typing.Sequence[bytes]],
+    bucket: typing.Optional[_Bucket],
+    found: typing.Optional[bool],
+    suffix: bytes,
+    label: bytes,
+) -> None:
+    # This runs within the timed lookup, leave its own time out of the duration.
+    started = time.perf_counter_ns()
+    stats.buckets.append(key)
+    if bucket is not None:
+        stats.entries_compared += 1
+    else:
+        # Count the entries _match_entries() went through before returning
+        # 'found', only done here so that untraced scans don't pay for it.
+        target = label if found is None else suffix
+        for flags, name, size in _iter_names(entries, suffixes):
+            stats.entries_compared += 1
+            stats.bytes_read += size
+            if (
+                found is not False
+                and bool(flags & _IS_LEAF) is bool(found)
+                and name == target
+            ):
+                break
+    stats.duration_ns -= time.perf_counter_ns() - started
+
+
+def load_index() -> None:
+    """Decodes the whole data file into an in-memory index. Lookups then
+    only probe a couple of sets per label instead of scanning buckets,
+    at the cost of a few MB of memory. The data file is released.
+    """
+    global _index
+    index = functools.partial(_in_index, _build_index(_get_data()))
+    _unshare_index(_index)
+    _index = index
+    close()
+
+
+def unload_index() -> None:
+    """Drops the in-memory or shared index and goes back to reading the data file"""
+    global _index
+    _unshare_index(_index)
+    _index = None
+
+
+def _unshare_index(
+    index: typing.Optional[typing.Callable[[bytes], LookupResult]],
+) -> None:
+    # Workers started after a shared index is dropped mustn't attach to it.
+    if index is _attach_from_environ or (
+        isinstance(index, functools.partial) and index.func is _in_shared_index
+    ):
+        os.environ.pop(_INDEX_ENV, None)
+
+
+def share_index(path: typing.Optional[str] = None) -> str:
+    """Writes an index of the whole list to 'path', a temporary file that's
+    removed at exit by default, and switches lookups to it. Returns the path.
+
+    The index holds no Python objects per host, it's mapped read-only so
+    forked workers share its pages without copy-on-write. Workers started any
+    other way attach to it on their first lookup through the HSTSPRELOAD_INDEX
+    environment variable, which is set to the path until the index is dropped.
+    """
+    contents = _encode_index()
+    if path is None:
+        import atexit
+        import tempfile
+
+        shm = "/dev/shm"
+        fd, path = tempfile.mkstemp(
+            prefix="hstspreload-",
+            suffix=".index",
+            dir=shm if os.path.isdir(shm) else None,
+        )
+        with os.fdopen(fd, "wb") as f:
+            f.write(contents)
+
+        # Forked workers exit through atexit too, only the owner removes it.
+        owner = os.getpid()
+        atexit.register(_remove_index, path, owner)
+    else:
+        # Workers attaching while it's written must not see a partial file.
+        with open(path + ".tmp", "wb") as f:
+            f.write(contents)
+        os.replace(path + ".tmp", path)
+
+    attach_index(path)
+    os.environ[_INDEX_ENV] = path
+    return path
+
+
+def attach_index(path: str) -> None:
+    """Switches lookups to an index written by share_index(). The data file
+    is released. Raises ValueError if it's not an index of this list.
+    """
+    global _index
+    with open(path, "rb") as f:
+        source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    _index = functools.partial(_in_shared_index, _parse_index(source))
+    close()
+
+
+class _SharedIndex(typing.NamedTuple):
+    """An index file mapped by attach_index()"""
+
+    hashes: typing.Sequence[int]
+    offsets: typing.Sequence[int]
+    names: memoryview
+    flags: memoryview
+
+
+def _encode_index() -> bytes:
+    entries = sorted(
+        (_index_hash(name), name, include) for name, include in _iter_rules()
+    )
+    offsets = [0]
+    for _, name, _ in entries:
+        offsets.append(offsets[-1] + len(name))
+    return _encode_sections(
+        _INDEX_MAGIC,
+        _INDEX_VERSION,
+        [
+            (b"LIST", (_dataset.checksum or "").encode("ascii")),
+            (b"HASH", struct.pack("<%dQ" % len(entries), *[x[0] for x in entries])),
+            (b"OFFS", struct.pack("<%dI" % len(offsets), *offsets)),
+            (b"NAME", b"".join(x[1] for x in entries)),
+            (b"FLAG", bytes(x[2] for x in entries)),
+        ],
+    )
+
+
+def _parse_index(source: mmap.mmap) -> _SharedIndex:
+    magic, version, sections = _parse_sections(source)
+    if magic != _INDEX_MAGIC:
+        raise ValueError("not a hstspreload index file")
+    if version != _INDEX_VERSION:
+        raise ValueError("index file has unsupported format %d" % version)
+    # The packaged data file may have been patched since this module was
+    # generated, the list in use is only known once it's opened.
+    _get_data()
+    if bytes(sections.get(b"LIST", b"")) != (_dataset.checksum or "").encode("ascii"):
+        raise ValueError("index file was built from a different list")
+    return _SharedIndex(
+        _cast_uint64(sections[b"HASH"]),
+        _cast_uint32(sections[b"OFFS"]),
+        sections[b"NAME"],
+        sections[b"FLAG"],
+    )
+
+
+def _remove_index(path: str, owner: int) -> None:
+    if os.getpid() == owner:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _index_hash(name: bytes) -> int:
+    h1, h2 = _bloom_hashes(name)
+    return h1 << 32 | h2
+
+
+def _in_shared_index(index: _SharedIndex, host: bytes) -> LookupResult:
+    include = _find_in_shared_index(index, host)
+    if include is not None:
+        return LookupResult(True, host, False, include and b"." not in host)
+    dot = host.find(b".")
+    while dot != -1:
+        name = host[dot + 1 :]
+        if _find_in_shared_index(index, name):
+            return LookupResult(True, name, True, b"." not in name)
+        dot = host.find(b".", dot + 1)
+    return _NOT_PRELOADED
+
+
+def _find_in_shared_index(index: _SharedIndex, name: bytes) -> typing.Optional[bool]:
+    """Returns the include_subdomains flag of a preloaded name, None otherwise"""
+    key = _index_hash(name)
+    hashes = index.hashes
+    position = bisect_left(hashes, key)
+    while position < len(hashes) and hashes[position] == key:
+        start = index.offsets[position]
+        if index.names[start : index.offsets[position + 1]] == name:
+            return bool(index.flags[position])
+        position += 1
+    return None
+
+
+def _attach_from_environ(host: bytes) -> LookupResult:
+    # Stands in for the index of workers started with HSTSPRELOAD_INDEX set
+    # until their first lookup attaches to it.
+    _attach_environ_index()
+    index = _index
+    return _lookup(host) if index is None else index(host)
+
+
+def _attach_environ_index() -> None:
+    global _index
+    if _index is _attach_from_environ:
+        try:
+            attach_index(os.environ[_INDEX_ENV])
+        except (KeyError, OSError, ValueError):
+            # Lookups still work from the data file, only slower.
+            _index = None
+
+
+if os.environ.get(_INDEX_ENV):
+    _index = _attach_from_environ
+
+
+def _build_index(
+    data: _Data,
+) -> typing.Tuple[typing.FrozenSet[bytes], typing.FrozenSet[bytes]]:
+    """Returns the set of exact hosts and the set of include_subdomains hosts"""
+    exact = set()
+    include_subdomains = set()
+    for name, include in _iter_rules(data):
+        exact.add(name)
+        if include:
+            include_subdomains.add(name)
+    return frozenset(exact), frozenset(include_subdomains)
+
+
+def _in_index(
+    index: typing.Tuple[typing.FrozenSet[bytes], typing.FrozenSet[bytes]],
+    host: bytes,
+) -> LookupResult:
+    exact, include_subdomains = index
+    if host in exact:
+        fast_path = b"." not in host and host in include_subdomains
+        return LookupResult(True, host, False, fast_path)
+    dot = host.find(b".")
+    while dot != -1:
+        name = host[dot + 1 :]
+        if name in include_subdomains:
+            return LookupResult(True, name, True, b"." not in name)
+        dot = host.find(b".", dot + 1)
+    return _NOT_PRELOADED
+
+
+def _iter_leaves(
+    data: typing.Optional[_Data] = None,
+) -> typing.Iterable[typing.Tuple[bytes, bool]]:
+    """Yields every preloaded host along with its include_subdomains flag"""
+    data = data or _get_data()
+    for flags, name, _ in _iter_names(data.buckets, data.suffixes):
+        if flags & _IS_LEAF:
+            yield name, bool(flags & _INCLUDE_SUBDOMAINS)
+
+
+def _iter_rules(
+    data: typing.Optional[_Data] = None,
+) -> typing.Iterable[typing.Tuple[bytes, bool]]:
+    """Same as _iter_leaves() but leaves out hosts whose parent domain includes
+    its subdomains, as the parent always matches first. An index of the rest
+    matches at most one entry per host, the same one as the data file.
+    """
+    leaves = dict(_iter_leaves(data))
+    for name, include in leaves.items():
+        dot = name.find(b".")
+        while dot != -1:
+            if leaves.get(name[dot + 1 :]):
+                break
+            dot = name.find(b".", dot + 1)
+        else:
+            yield name, include
+
+
+def _normalize_host(host: typing.AnyStr) -> bytes:
+    if isinstance(host, str):
+        host = host.encode("ascii")
+    return host.lower()
+
+
+def _in_bloom_filter(bloom: _Bloom, host: bytes) -> bool:
+    """Checks the host and its parent domains against the Bloom filter.
+    Returns False if none of them can be on the list, True if one might be.
+    """
+    hashes, bits, bitarray = bloom
+    # Preloaded hosts have at most 5 labels so skip any labels beyond that.
+    suffix = host
+    for _ in range(host.count(b".") - 4):
+        suffix = suffix[suffix.find(b".") + 1 :]
+
+    while True:
+        h1, h2 = _bloom_hashes(suffix)
+        for i in range(hashes):
+            bit = (h1 + i * h2) % bits
+            if not bitarray[bit >> 3] & (1 << (bit & 7)):
+                break
+        else:
+            return True
+
+        # Don't check the TLD on its own, the only TLDs on the
+        # list that matter here are the ones in the gTLD fast path.
+        dot = suffix.find(b".")
+        if dot == -1 or suffix.find(b".", dot + 1) == -1:
+            return False
+        suffix = suffix[dot + 1 :]
+
+
+def _bloom_hashes(value: bytes) -> typing.Tuple[int, int]:
+    """Returns the two hashes that the Bloom filter's bit positions derive from"""
+    return zlib.crc32(value), zlib.crc32(value[::-1]) | 1
+
+
+def _bucket_key(version: int, layer: int, label: bytes) -> int:
+    """Returns the key of the bucket for a label on a layer"""
+    if version == 1:
+        return layer * 256 + _crc8(label)
+    return layer << 16 | zlib.crc32(label) & 0xFFFF
+
+
+def _read_bucket(data: _Data, key: int) -> typing.Optional[memoryview]:
+    """Returns the entries of the bucket with the given key, None if empty"""
+    keys = data.keys
+    layers = data.layers
+    if keys is None:
+        position = key
+    elif layers is None:
+        position = bisect_left(keys, key)
+        if position == len(keys) or keys[position] != key:
+            return None
+    else:
+        # Search the range of the key's layer for its label hash.
+        layer = key >> 16
+        if layer + 1 >= len(layers):
+            return None
+        end = layers[layer + 1]
+        position = bisect_left(keys, key & 0xFFFF, layers[layer], end)
+        if position == end or keys[position] != key & 0xFFFF:
+            return None
+
+    jumptable = data.jumptable
+    start = jumptable[position]
+    end = jumptable[position + 1]
+    high = data.high
+    if high is not None:
+        # Add the upper bits of both offsets.
+        wraps = bisect_right(high, position)
+        start |= wraps << 16
+        end |= bisect_right(high, position + 1, wraps) << 16
+    if start == end:
+        return None
+    return data.buckets[start:end]
+
+
+def _get_bucket(
+    data: _Data, key: int, entries: memoryview, decode: bool = False
+) -> typing.Optional[_Bucket]:
+    """Returns the decoded bucket if it's cached or has been requested before.
+    Buckets seen for the first time are left to be scanned in place, as are
+    small buckets which are quicker to scan than to decode and cache.
+    """
+    if len(entries) <= _SCAN_BUCKET_SIZE:
+        return None
+
+    decoded = data.decoded
+    with _buckets_lock:
+        if key in decoded:
+            decoded.move_to_end(key)
+            bucket = decoded[key]
+            if bucket is not None:
+                return bucket
+        elif not decode:
+            decoded[key] = None
+            if len(decoded) > _BUCKET_CACHE_SIZE:
+                decoded.popitem(last=False)
+            return None
+
+    bucket = _decode_bucket(entries, data.suffixes)
+    with _buckets_lock:
+        decoded[key] = bucket
+        if len(decoded) > _BUCKET_CACHE_SIZE:
+            decoded.popitem(last=False)
+    return bucket
+
+
+def _decode_bucket(
+    data: memoryview, suffixes: typing.Optional[typing.Sequence[bytes]] = None
+) -> _Bucket:
+    leaves = {}
+    labels = set()
+    for flags, name, _ in _iter_names(data, suffixes):
+        if flags & _IS_LEAF:
+            leaves[name] = bool(flags & _INCLUDE_SUBDOMAINS)
+        else:
+            labels.add(name)
+    return leaves, frozenset(labels)
+
+
+def _match_bucket(
+    bucket: _Bucket, host: bytes, suffix: bytes, label: bytes
+) -> typing.Optional[bool]:
+    """Same as _match_entries() but for a decoded bucket"""
+    leaves, labels = bucket
+    include_subdomains = leaves.get(suffix)
+    if include_subdomains is not None and (
+        include_subdomains or len(suffix) == len(host)
+    ):
+        return True
+    return None if label in labels else False
+
+
+def _match_entries(
+    data: memoryview, host: bytes, suffix: bytes, label: bytes
+) -> typing.Optional[bool]:
+    """Matches a host against the entries of one bucket without copying them.
+    'suffix' is the host's labels up to and including 'label'. Returns None
+    if the host's label is found and traversal continues on the next layer.
+    """
+    suffix_size = len(suffix)
+    label_size = len(label)
+    for flags, start, end in _iter_entries(data):
+        # We found a potential leaf, leaves on this layer
+        # have as many labels as the suffix so compare to that.
+        if flags & _IS_LEAF:
+            if end - start == suffix_size and data[start:end] == suffix:
+                if flags & _INCLUDE_SUBDOMAINS or suffix_size == len(host):
+                    return True
+
+        # Continue traversing as we're not at a leaf.
+        elif end - start == label_size and data[start:end] == label:
+            return None
+    return False
+
+
+def _match_compact_entries(
+    data: memoryview,
+    suffixes: typing.Sequence[bytes],
+    host: bytes,
+    suffix: bytes,
+    label: bytes,
+) -> typing.Optional[bool]:
+    """Same as _match_entries() for format 3, a leaf matches if its label
+    does and its parent domain in 'suffixes' is the rest of the suffix.
+    """
+    label_size = len(label)
+    parent = suffix[label_size + 1 :]
+    offset = 0
+    size = len(data)
+    while offset < size:
+        header = data[offset]
+        start = offset + 1
+        offset = end = start + (header & _LABEL_SIZE)
+        if header & _IS_LEAF:
+            ref = data[end]
+            offset += 1
+            if ref & 0x80:
+                ref = ref & 0x7F | data[offset] << 7
+                offset += 1
+            if (
+                end - start == label_size
+                and data[start:end] == label
+                and suffixes[ref] == parent
+                and (header & _INCLUDE_SUBDOMAINS or len(suffix) == len(host))
+            ):
+                return True
+
+        elif end - start == label_size and data[start:end] == label:
+            return None
     return False
 
 
-def _iter_entries(data: bytes) -> typing.Iterable[typing.Tuple[int, int, bytes]]:
-    while data:
-        flags = data[0]
-        size = data[1]
-        label = bytes(data[2 : 2 + size])
-        yield (flags & _IS_LEAF, flags & _INCLUDE_SUBDOMAINS, label)
-        data = data[2 + size :]
+def _iter_entries(data: memoryview) -> typing.Iterable[typing.Tuple[int, int, int]]:
+    """Yields the flags and the start and end offsets of each entry's label"""
+    offset = 0
+    while offset < len(data):
+        start = offset + 2
+        offset = start + data[offset + 1]
+        yield data[start - 2], start, offset
+
+
+def _iter_compact_entries(
+    data: memoryview,
+) -> typing.Iterable[typing.Tuple[int, int, int, typing.Optional[int]]]:
+    """Same as _iter_entries() for format 3, also yields the position of
+    a leaf's parent domain in the suffix table and None for other entries.
+    """
+    offset = 0
+    while offset < len(data):
+        header = data[offset]
+        start = offset + 1
+        offset = end = start + (header & _LABEL_SIZE)
+        ref = None
+        if header & _IS_LEAF:
+            ref = data[end]
+            offset += 1
+            if ref & 0x80:
+                ref = ref & 0x7F | data[offset] << 7
+                offset += 1
+        yield header & (_IS_LEAF | _INCLUDE_SUBDOMAINS), start, end, ref
+
+
+def _iter_names(
+    data: memoryview, suffixes: typing.Optional[typing.Sequence[bytes]]
+) -> typing.Iterable[typing.Tuple[int, bytes, int]]:
+    """Yields the flags of each entry, the whole name of a leaf or the label
+    of any other entry and the size of the entry in bytes, in any format.
+    """
+    if suffixes is None:
+        for flags, start, end in _iter_entries(data):
+            yield flags, bytes(data[start:end]), end - start + 2
+        return
+
+    for flags, start, end, ref in _iter_compact_entries(data):
+        name = bytes(data[start:end])
+        if ref is None:
+            yield flags, name, end - start + 1
+        else:
+            if suffixes[ref]:
+                name += b"." + suffixes[ref]
+            yield flags, name, end - start + (2 if ref < 0x80 else 3)
 
 
 def _crc8(value: bytes) -> int:
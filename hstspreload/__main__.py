@@ -0,0 +1,168 @@
+"""Checks hosts or URLs read from files or stdin against the HSTS preload list"""
+
+import argparse
+import collections
+import concurrent.futures
+import io
+import itertools
+import os
+import re
+import sys
+import typing
+
+from . import _encode_host, in_hsts_preload_many
+
+# Optional scheme and userinfo, then either an IPv6 literal or a host name.
+_HOST_RE = re.compile(
+    r"\s*(?:[A-Za-z][A-Za-z0-9+.-]*://)?(?:[^@/?#\s]*@)?(\[[^\]/?#]*\]|[^:/?#\s]*)"
+)
+
+
+def _extract_host(line: str) -> typing.Optional[bytes]:
+    """Returns the IDNA-encoded host of a host or URL, None if there isn't one"""
+    return _encode_host(_HOST_RE.match(line).group(1))  # type: ignore[union-attr]
+
+
+def _check_lines(lines: typing.List[str], output: str) -> str:
+    """Checks a chunk of lines and returns the text to write for them"""
+    hosts = [_extract_host(line) for line in lines]
+    results = iter(in_hsts_preload_many([host for host in hosts if host is not None]))
+
+    chunks = []
+    for line, host in zip(lines, hosts):
+        found = None if host is None else next(results)
+        if output == "annotate":
+            status = "invalid" if found is None else "true" if found else "false"
+            chunks.append("%s\t%s\n" % (line, status))
+        elif found is (output == "preloaded"):
+            chunks.append(line + "\n")
+    return "".join(chunks)
+
+
+def _read_chunks(
+    files: typing.List[str], chunk_size: int
+) -> typing.Iterator[typing.List[str]]:
+    """Yields lists of up to 'chunk_size' lines without their line endings"""
+    for path in files:
+        if path == "-":
+            f = sys.stdin
+        else:
+            f = open(path, encoding="utf-8", errors="surrogateescape")
+        try:
+            lines = (line.rstrip("\r\n") for line in f)
+            while True:
+                chunk = list(itertools.islice(lines, chunk_size))
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def _check_chunks_in_pool(
+    chunks: typing.Iterator[typing.List[str]], output: str, jobs: int, ordered: bool
+) -> typing.Iterator[str]:
+    """Checks chunks in 'jobs' worker processes, keeping at most two chunks per
+    worker in flight so that memory doesn't grow with the input. The workers
+    each map the same read-only data file, the OS shares its pages among them.
+    """
+    window = jobs * 2
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        if ordered:
+            queue: typing.Deque[concurrent.futures.Future[str]] = collections.deque()
+            for chunk in chunks:
+                if len(queue) >= window:
+                    yield queue.popleft().result()
+                queue.append(executor.submit(_check_lines, chunk, output))
+            while queue:
+                yield queue.popleft().result()
+        else:
+            pending: typing.Set[concurrent.futures.Future[str]] = set()
+            for chunk in chunks:
+                if len(pending) >= window:
+                    done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        yield future.result()
+                pending.add(executor.submit(_check_lines, chunk, output))
+            for future in concurrent.futures.as_completed(pending):
+                yield future.result()
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m hstspreload", description=__doc__)
+    parser.add_argument(
+        "files",
+        nargs="*",
+        default=["-"],
+        help="files with one host or URL per line, '-' or none for stdin",
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--preloaded",
+        dest="output",
+        action="store_const",
+        const="preloaded",
+        help="only write lines whose host is preloaded",
+    )
+    mode.add_argument(
+        "--not-preloaded",
+        dest="output",
+        action="store_const",
+        const="not-preloaded",
+        help="only write lines whose host isn't preloaded",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes (default: 1)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10000,
+        help="lines checked at a time by each worker (default: 10000)",
+    )
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        help="write chunks as workers finish them instead of in input order",
+    )
+    parser.set_defaults(output="annotate")
+    args = parser.parse_args(argv)
+    if args.jobs < 1 or args.chunk_size < 1:
+        parser.error("--jobs and --chunk-size must be at least 1")
+
+    # Logs aren't always valid UTF-8, pass undecodable bytes through as is.
+    for stream in (sys.stdin, sys.stdout):
+        if isinstance(stream, io.TextIOWrapper):
+            stream.reconfigure(errors="surrogateescape")
+
+    chunks = _read_chunks(args.files, args.chunk_size)
+    if args.jobs == 1:
+        results: typing.Iterator[str] = (
+            _check_lines(chunk, args.output) for chunk in chunks
+        )
+    else:
+        results = _check_chunks_in_pool(
+            chunks, args.output, args.jobs, not args.unordered
+        )
+    try:
+        for text in results:
+            sys.stdout.write(text)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # The reader went away, e.g. piped into 'head'. Point stdout at
+        # devnull so that flushing it at exit doesn't raise again.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
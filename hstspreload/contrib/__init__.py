@@ -0,0 +1 @@
+"""Adapters that upgrade requests of HTTP clients to preloaded hosts to HTTPS"""
@@ -0,0 +1,64 @@
+"""Upgrades httpx requests to preloaded hosts to HTTPS before connecting"""
+
+import typing
+
+import httpx
+
+from .. import ain_hsts_preload, in_hsts_preload
+
+
+class HSTSTransport(httpx.BaseTransport):
+    """Transport that rewrites http:// requests to preloaded hosts to https://
+    before handing them to the wrapped transport, e.g.
+    httpx.Client(transport=HSTSTransport()).
+    """
+
+    def __init__(self, transport: typing.Optional[httpx.BaseTransport] = None) -> None:
+        self._transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        host = _http_host(request.url)
+        if host is not None and in_hsts_preload(host):
+            _upgrade_request(request)
+        return self._transport.handle_request(request)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class AsyncHSTSTransport(httpx.AsyncBaseTransport):
+    """Same as HSTSTransport for httpx.AsyncClient, hosts are looked up with
+    ain_hsts_preload() so the event loop isn't blocked reading the data file
+    """
+
+    def __init__(
+        self, transport: typing.Optional[httpx.AsyncBaseTransport] = None
+    ) -> None:
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = _http_host(request.url)
+        if host is not None and await ain_hsts_preload(host):
+            _upgrade_request(request)
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def _http_host(url: httpx.URL) -> typing.Optional[bytes]:
+    """Returns the host of an http:// URL, None for other URLs"""
+    host = url.raw_host.rstrip(b".")
+    if url.scheme != "http" or not host:
+        return None
+    return host
+
+
+def _upgrade_request(request: httpx.Request) -> None:
+    url = request.url
+    # An explicit port 80 becomes the default port, other ports are kept.
+    request.url = url.copy_with(
+        scheme="https", port=None if url.port == 80 else url.port
+    )
+    if request.headers.get("Host") == url.netloc.decode("ascii"):
+        request.headers["Host"] = request.url.netloc.decode("ascii")
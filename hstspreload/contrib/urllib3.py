@@ -0,0 +1,18 @@
+"""Upgrades urllib3 requests to preloaded hosts to HTTPS before connecting"""
+
+import typing
+
+import urllib3
+
+from .. import upgrade_url
+
+
+class HSTSPoolManager(urllib3.PoolManager):
+    """PoolManager that rewrites http:// URLs of preloaded hosts to https://
+    before opening a connection, including the URLs of redirects.
+    """
+
+    def urlopen(  # type: ignore[override]
+        self, method: str, url: str, redirect: bool = True, **kw: typing.Any
+    ) -> urllib3.BaseHTTPResponse:
+        return super().urlopen(method, upgrade_url(url), redirect=redirect, **kw)
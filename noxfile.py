@@ -6,6 +6,8 @@ source_files = (
     "hstspreload/",
     "test_hstspreload.py",
     "build-hstspreload.py",
+    "bench-hstspreload.py",
+    "profile-hstspreload.py",
     "setup.py",
     "noxfile.py",
 )
@@ -49,6 +51,13 @@ def test(session):
     session.run("python", "-m", "pytest", "-q", "test_hstspreload.py")
 
 
+@nox.session(reuse_venv=True)
+def bench(session):
+    session.install(".")
+
+    session.run("python", "bench-hstspreload.py", "--json=bench.json", *session.posargs)
+
+
 @nox.session(reuse_venv=True)
 def deploy(session):
     session.install("-rrequirements/deploy.txt")
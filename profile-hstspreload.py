@@ -0,0 +1,106 @@
+"""Reports which buckets of hstspreload.bin are hottest for a sample of hosts"""
+
+import argparse
+import collections
+import random
+import sys
+
+import hstspreload
+from hstspreload import (
+    _bucket_key,
+    _get_data,
+    _iter_leaves,
+    _normalize_host,
+    _read_bucket,
+)
+
+
+def load_sample(size):
+    """Builds a deterministic mix of preloaded hosts, their subdomains and misses"""
+    leaves = [name for name, _ in _iter_leaves()]
+
+    rand = random.Random(0)
+    hosts = []
+    for _ in range(size):
+        leaf = rand.choice(leaves)
+        kind = rand.randrange(3)
+        if kind == 0:
+            hosts.append(leaf)
+        elif kind == 1:
+            hosts.append(b"www." + leaf)
+        else:
+            hosts.append(b"not-preloaded-%d.%s" % (rand.randrange(10**6), leaf))
+    return hosts
+
+
+def read_hosts(path):
+    with open(path) as f:
+        return [
+            _normalize_host(line.strip())
+            for line in f
+            if line.strip() and not line.startswith("#")
+        ]
+
+
+def print_histogram(name, histogram, total):
+    print(name)
+    for value, count in sorted(histogram.items()):
+        print("%12d %10d %7.2f%%" % (value, count, count * 100 / total))
+    print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "hosts", nargs="?", help="file with one host per line, defaults to a sample"
+    )
+    parser.add_argument("--sample-size", type=int, default=100000)
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    hosts = read_hosts(args.hosts) if args.hosts else load_sample(args.sample_size)
+    data = _get_data()
+
+    # Map bucket keys back to the labels of the sample that use them.
+    labels = collections.defaultdict(set)
+    for host in hosts:
+        for layer, label in enumerate(host.split(b".")[::-1][:5]):
+            labels[_bucket_key(data.version, layer, label)].add(label)
+
+    # Without the cache every lookup walks the buckets.
+    histograms = hstspreload.LookupHistograms()
+    hstspreload.set_cache_size(0)
+    hstspreload.set_lookup_hook(histograms)
+    try:
+        for host in hosts:
+            hstspreload.in_hsts_preload(host)
+    finally:
+        hstspreload.set_lookup_hook(None)
+
+    total = histograms.lookups
+    print("lookups         %10d" % total)
+    print("gTLD fast path  %10d" % histograms.fast_path)
+    print("Bloom rejected  %10d" % histograms.bloom_rejected)
+    print()
+    print_histogram("layers", histograms.layers, total)
+    print_histogram("entries compared", histograms.entries_compared, total)
+    print_histogram("bytes read", histograms.bytes_read, total)
+    print_histogram("duration (ns)", histograms.duration_ns, total)
+
+    print(
+        "%10s %6s %8s %10s %8s  %s"
+        % ("key", "layer", "bytes", "uses", "share", "labels")
+    )
+    for key, uses in histograms.buckets.most_common(args.top):
+        layer = key // 256 if data.version == 1 else key >> 16
+        size = len(_read_bucket(data, key) or b"")
+        examples = b",".join(sorted(labels[key])[:3]).decode("ascii")
+        print(
+            "%10d %6d %8d %10d %7.2f%%  %s"
+            % (key, layer, size, uses, uses * 100 / total, examples)
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -20,12 +20,14 @@ setup(
     url="https://github.com/sethmlarson/hstspreload",
     author="Seth Michael Larson",
     author_email="sethmichaellarson@gmail.com",
-    packages=["hstspreload"],
+    packages=["hstspreload", "hstspreload.contrib"],
     package_dir={"hstspreload": "hstspreload"},
     package_data={"hstspreload": ["hstspreload.bin"]},
     include_package_data=True,
+    entry_points={"console_scripts": ["hstspreload=hstspreload.__main__:main"]},
     zip_safe=False,
     python_requires=">=3.9",
+    extras_require={"httpx": ["httpx"], "urllib3": ["urllib3"]},
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Environment :: Web Environment",